@@ -0,0 +1,37 @@
+"""
+Benchmark the two `hires_tile` engines: sub-tiles merge ('tiles') vs single warped read ('warp')
+usage: python bench_hires_tile.py [raster_url] [x y z] [max zoom offset]
+"""
+import sys
+import time
+import numpy as np
+from calval.raster_utils import hires_tile
+
+default_url = (
+    'tests/data/scenes/S2A_MSIL1C_20180526T081601_N0206_R121_T36RXU_20180526T120617.SAFE'
+    '/GRANULE/L1C_T36RXU_A015276_20180526T081919/IMG_DATA/T36RXU_20180526T081601_B03.jp2')
+default_coords = (2446, 1688, 12)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(url, base_coords, max_offset=4):
+    print('{:>6} {:>10} {:>10} {:>8} {:>14}'.format('offset', 'tiles[s]', 'warp[s]', 'speedup', 'p99 reldiff'))
+    for offset in range(max_offset + 1):
+        zoomlevel = base_coords[-1] + offset
+        tiles, tiles_time = timed(hires_tile, url, base_coords, zoomlevel, engine='tiles')
+        warped, warp_time = timed(hires_tile, url, base_coords, zoomlevel, engine='warp')
+        reldiff = np.ma.abs(warped.image.astype(float) - tiles.image) / tiles.image
+        print('{:>6} {:>10.3f} {:>10.3f} {:>8.1f} {:>14.5f}'.format(
+            offset, tiles_time, warp_time, tiles_time / warp_time, np.percentile(reldiff.compressed(), 99)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    url = args[0] if args else default_url
+    coords = tuple(int(x) for x in args[1:4]) if len(args) >= 4 else default_coords
+    main(url, coords, int(args[4]) if len(args) >= 5 else 4)
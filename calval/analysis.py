@@ -1,8 +1,60 @@
+import os
+import uuid
 import warnings
+from functools import lru_cache
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from pyspectral.solar import SolarIrradianceSpectrum, TOTAL_IRRADIANCE_SPECTRUM_2000ASTM
+from calval.config import cache_dir
+
+# on-disk cache of interpolated solar spectra (set to None to disable)
+solar_spectrum_cache_dir = os.path.join(cache_dir, 'solar_spectrum')
+
+
+quantities = ['toa', 'toa_errs', 'sr', 'sr_errs']
+
+
+class _SRFKey:
+    """
+    Hashable key of an SRF, by its class and parameters (keeping the SRF itself for evaluating it)
+    """
+    def __init__(self, srf):
+        self.srf = srf
+        self._key = (type(srf), float(srf.start), float(srf.end),
+                     tuple(np.asarray(srf.response, dtype=float).tolist()))
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        return isinstance(other, _SRFKey) and self._key == other._key
+
+
+@lru_cache(maxsize=64)
+def _srf_matrix(srf_keys, wavelengths):
+    """
+    :return: matrix of the SRFs (rows) evaluated at `wavelengths` (columns)
+    """
+    wavelengths = np.array(wavelengths)
+    return np.nan_to_num(np.array([key.srf(wavelengths) for key in srf_keys], dtype=float))
+
+
+def integrate_many(site_measurements, srfs):
+    """
+    integrate site measurement over several SRFs at once
+    :param site_measurements: radcalnet.SiteMeasurement
+    :param srfs: list of SRF
+    :return: dict of quantity ('toa', 'toa_errs', 'sr', 'sr_errs') to DataFrame, with a column per SRF
+       (by position in `srfs`)
+    """
+    srf_keys = tuple(_SRFKey(srf) for srf in srfs)
+    result = {}
+    for data in quantities:
+        measurements_df = getattr(site_measurements, data)
+        wavelengths = tuple(float(c) for c in measurements_df.columns)
+        srf_matrix = _srf_matrix(srf_keys, wavelengths)  # interpolated to wavelengths of site measurements
+        values = np.nan_to_num(measurements_df.values.astype(float)) @ srf_matrix.T
+        result[data] = pd.DataFrame(values.astype(np.float32), index=measurements_df.index)
+    return result
 
 
 def integrate(site_measurements, srf):
@@ -12,15 +64,50 @@ def integrate(site_measurements, srf):
     :param srf: SRF
     :return: 4x TimeSeries: toa, toa_errs, sr, sr_errs
     """
-    def _integrate(measurements_df, srf):
-        measured_spectrum = [float(c) for c in measurements_df.columns]
-        srf_interpolated = np.nan_to_num(srf(measured_spectrum))  # interpolated to wavelengths of site measurements
-        integrated_values = {time: np.dot(srf_interpolated, np.nan_to_num(row.values))
-                             for time, row in measurements_df.iterrows()}
-        return pd.Series(data=integrated_values).astype(np.float32)
+    result = integrate_many(site_measurements, [srf])
+    return [result[data][0].rename(None) for data in quantities]
+
+
+def _load_solar_spectrum(path):
+    try:
+        with np.load(path) as data:
+            return data['wavelengths'], data['irradiance']
+    except (OSError, ValueError, KeyError):
+        return None
+
 
-    return [_integrate(getattr(site_measurements, data), srf)
-            for data in ['toa', 'toa_errs', 'sr', 'sr_errs']]
+def _save_solar_spectrum(path, wavelengths, irradiance):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp.npz'.format(path[:-len('.npz')], uuid.uuid4().hex)
+        np.savez(tmp_path, wavelengths=wavelengths, irradiance=irradiance)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # the disk cache is best effort
+
+
+@lru_cache(maxsize=16)
+def solar_spectrum(dlambda_nm=0.5, start_nm=200.0, end_nm=2000.0):
+    """
+    The exatmospheric solar irradiance spectrum at 1a.u., interpolated with the given parameters.
+    Cached per process, and on disk in `solar_spectrum_cache_dir` (unless it is None).
+    :return: (wavelengths, irradiance) read-only arrays, in [nm], [W/(m^2 nm)]
+    """
+    path = None
+    if solar_spectrum_cache_dir is not None:
+        path = os.path.join(solar_spectrum_cache_dir, 'spectrum_{!r}_{!r}_{!r}.npz'.format(
+            float(dlambda_nm), float(start_nm), float(end_nm)))
+    spectrum = _load_solar_spectrum(path) if path is not None and os.path.exists(path) else None
+    if spectrum is None:
+        from pyspectral.solar import SolarIrradianceSpectrum, TOTAL_IRRADIANCE_SPECTRUM_2000ASTM
+        srr = SolarIrradianceSpectrum(TOTAL_IRRADIANCE_SPECTRUM_2000ASTM, dlambda=dlambda_nm/1000)
+        srr.interpolate(ival_wavelength=(start_nm/1000, end_nm/1000))
+        spectrum = srr.ipol_wavelength * 1000, srr.ipol_irradiance / 1000.0
+        if path is not None:
+            _save_solar_spectrum(path, *spectrum)
+    for arr in spectrum:
+        arr.flags.writeable = False
+    return spectrum
 
 
 def exatmospheric_irradiance(srf, dlambda_nm=0.5, start_nm=200.0, end_nm=2000.0):
@@ -33,12 +120,7 @@ def exatmospheric_irradiance(srf, dlambda_nm=0.5, start_nm=200.0, end_nm=2000.0)
     warnings.warn(DeprecationWarning(
         '`exatmospheric_irradiance` is scheduled to be removed, '
         'use `srf_exatmospheric_irradiance` (nm based units) instead.'))
-    srr = SolarIrradianceSpectrum(TOTAL_IRRADIANCE_SPECTRUM_2000ASTM, dlambda=dlambda_nm/1000)
-    srr.interpolate(ival_wavelength=(start_nm/1000, end_nm/1000))
-    lambdas = srr.ipol_wavelength * 1000
-    response = srf(lambdas)
-    avg = np.dot(response, srr.ipol_irradiance) / np.sum(response)
-    return avg
+    return srf_exatmospheric_irradiance(srf, dlambda_nm, start_nm, end_nm) * 1000.0
 
 
 def srf_exatmospheric_irradiance(srf, dlambda_nm=0.5, start_nm=200.0, end_nm=2000.0):
@@ -48,15 +130,25 @@ def srf_exatmospheric_irradiance(srf, dlambda_nm=0.5, start_nm=200.0, end_nm=200
     `dlambda_nm`, `start_nm`, `end_nm`: interpolation parameters for the solar spectrum
     :return: band irradiance at 1au, in [W/(m^2 nm)]
     """
-    srr = SolarIrradianceSpectrum(TOTAL_IRRADIANCE_SPECTRUM_2000ASTM, dlambda=dlambda_nm/1000)
-    srr.interpolate(ival_wavelength=(start_nm/1000, end_nm/1000))
-    lambdas = srr.ipol_wavelength * 1000
-    values = srr.ipol_irradiance / 1000.0
+    lambdas, values = solar_spectrum(dlambda_nm, start_nm, end_nm)
     response = srf(lambdas)
     avg = np.dot(response, values) / np.sum(response)
     return avg
 
 
+def multiband_exatmospheric_irradiance(multiband_srf, dlambda_nm=0.5, start_nm=200.0, end_nm=2000.0):
+    """
+    Compute the exatmospheric solar irradiance at 1a.u. of all bands of a sensor
+    :param multiband_srf: MultiBandSRF (or a list of SRF)
+    `dlambda_nm`, `start_nm`, `end_nm`: interpolation parameters for the solar spectrum
+    :return: array of band irradiances at 1au, in [W/(m^2 nm)], ordered as the band SRFs
+    """
+    srfs = getattr(multiband_srf, 'srfs', multiband_srf)
+    lambdas, values = solar_spectrum(dlambda_nm, start_nm, end_nm)
+    responses = np.array([srf(lambdas) for srf in srfs])
+    return (responses @ values) / responses.sum(axis=1)
+
+
 def plot(types, site_measurements, srfs, with_errors=True, fig=None, show=True):
     """
     plots simulated TOA or SR, based on site measurements, and camera spectral response
@@ -69,6 +161,8 @@ def plot(types, site_measurements, srfs, with_errors=True, fig=None, show=True):
     :return: plt figure
     """
 
+    import matplotlib.pyplot as plt
+
     def _plot(data, err, with_errors, label):
         if with_errors:
             artists = plt.errorbar(data.index.values, data.values, yerr=err)
@@ -79,13 +173,14 @@ def plot(types, site_measurements, srfs, with_errors=True, fig=None, show=True):
 
     if fig is None:
         fig = plt.figure()
-    for srf in srfs:
+    integrated = integrate_many(site_measurements, srfs)
+    for i, srf in enumerate(srfs):
         # for type in types:
         if 'toa' in types or 'toa' == types:
-            data, err = integrate(site_measurements, srf)[:2]
+            data, err = integrated['toa'][i], integrated['toa_errs'][i]
             _plot(data, err, with_errors=with_errors, label='%s %s TOA' % (srf.satellite, srf.band))
         if 'sr' in types or 'sr' == types:
-            data, err = integrate(site_measurements, srf)[2:4]
+            data, err = integrated['sr'][i], integrated['sr_errs'][i]
             _plot(data, err, with_errors=with_errors, label='%s %s SR' % (srf.satellite, srf.band))
 
     fig.autofmt_xdate()
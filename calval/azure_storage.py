@@ -1,9 +1,13 @@
+import time
+import threading
 import itertools as it
+from concurrent.futures import ThreadPoolExecutor
 try:
     from azure.storage.blob import BlockBlobService
 except ImportError:  # pragma: no cover
     BlockBlobService = None
 from calval.normalized_scene import NormalizedSceneId, URLScene
+from calval.manifest import Manifest, manifest_filename
 
 
 def _parse_cstring(cstring):
@@ -23,12 +27,33 @@ def _cstring_endpoint(cstring):
 
 
 class AzureStorage:
-    def __init__(self, connection_string, container, prefix=''):
+    """
+    Storage of normalized scenes in an azure blob container.
+    Listings of blob prefixes are done concurrently by up to `max_workers` threads, and are
+    cached for `cache_ttl` seconds (None to disable caching).
+    If the prefix contains a manifest (see `calval.manifest`, `publish_manifest`), queries are
+    answered from it instead of listing, so scenes uploaded to such a prefix should be published
+    to its manifest. The manifest is checked at most once per `cache_ttl` seconds, by a single
+    conditional read (which transfers it only if its ETag changed).
+    `service` is a `BlockBlobService` (or any object with compatible `list_blobs`,
+    `get_blob_to_text` and `create_blob_from_text` methods), by default created from the
+    connection string.
+    """
+    def __init__(self, connection_string, container, prefix='', service=None, max_workers=8, cache_ttl=60):
         self.connection_string = connection_string
         self.endpoint = _cstring_endpoint(connection_string)
         self.container = container
         self.prefix = prefix
-        if BlockBlobService:
+        self.max_workers = max_workers
+        self.cache_ttl = cache_ttl
+        self._listings = {}
+        self._manifest = None
+        self._manifest_etag = None
+        self._manifest_checked = None
+        self._lock = threading.Lock()
+        if service is not None:
+            self.service = service
+        elif BlockBlobService:
             self.service = BlockBlobService(connection_string=connection_string)
         else:  # pragma: no cover
             self.service = None
@@ -41,24 +66,123 @@ class AzureStorage:
                 for blob in self.service.list_blobs(
                         self.container, prefix=prefix, delimiter='/'))
 
+    def _list(self, prefix):
+        """
+        :return: list of blob names (or sub-prefixes) directly under `prefix`, possibly cached
+        """
+        if self.cache_ttl is None:
+            return list(self._iter_blobnames(prefix))
+        with self._lock:
+            cached = self._listings.get(prefix)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        names = list(self._iter_blobnames(prefix))
+        with self._lock:
+            self._listings[prefix] = (time.monotonic(), names)
+        return names
+
+    def _list_all(self, prefixes):
+        """
+        :return: list of listings of all `prefixes` (listed concurrently)
+        """
+        if self.max_workers is None or self.max_workers <= 1 or len(prefixes) <= 1:
+            return [self._list(prefix) for prefix in prefixes]
+        with ThreadPoolExecutor(min(self.max_workers, len(prefixes))) as executor:
+            return list(executor.map(self._list, prefixes))
+
+    def clear_cache(self):
+        with self._lock:
+            self._listings.clear()
+            self._manifest_checked = None
+
+    def _read_manifest(self, etag=None):
+        """
+        :param etag: ETag of a previously read manifest, to read it only if it changed
+        :return: (Manifest, etag), (None, None) if there is no manifest, or (None, `etag`)
+           if it did not change
+        """
+        name = self.prefix + manifest_filename
+        condition = {} if etag is None else {'if_none_match': etag}
+        try:
+            blob = self.service.get_blob_to_text(self.container, name, **condition)
+        except Exception as e:
+            # 304: not modified, 404: not found
+            status_code = getattr(e, 'status_code', None)
+            if status_code == 304 and etag is not None:
+                return None, etag
+            if status_code == 404:
+                return None, None
+            raise
+        return Manifest.from_json(blob.content), blob.properties.etag
+
+    def manifest(self):
+        """
+        :return: the (possibly cached) Manifest of the prefix, or None if there is none
+        """
+        now = time.monotonic()
+        if (self._manifest_checked is not None and self.cache_ttl is not None and
+                now - self._manifest_checked < self.cache_ttl):
+            return self._manifest
+        manifest, etag = self._read_manifest(self._manifest_etag)
+        if manifest is not None or etag is None:
+            self._manifest, self._manifest_etag = manifest, etag
+        self._manifest_checked = now
+        return self._manifest
+
+    def publish_manifest(self, metadata_list, retries=10, create=True):
+        """
+        Add the scenes of `metadata_list` to the manifest of the prefix (creating it if needed,
+        unless `create` is False).
+        The update is atomic: it is done only if the manifest was not modified since read
+        (otherwise it is retried).
+        :return: True if the manifest was updated
+        """
+        name = self.prefix + manifest_filename
+        metadata_list = list(metadata_list)
+        for _ in range(retries):
+            manifest, etag = self._read_manifest()
+            if manifest is None:
+                if not create:
+                    return False
+                manifest = Manifest()
+            manifest.add(metadata_list)
+            condition = {'if_match': etag} if etag is not None else {'if_none_match': '*'}
+            try:
+                self.service.create_blob_from_text(self.container, name, manifest.to_json(), **condition)
+            except Exception as e:
+                # 412: precondition failed, 409: created concurrently
+                if getattr(e, 'status_code', None) in (409, 412):
+                    continue
+                raise
+            self.clear_cache()
+            return True
+        raise RuntimeError('Failed to update manifest {}: too many concurrent updates'.format(name))
+
     def query(self, **kwargs):
         assert self.service, 'Missing module: azure.storage.blob'
+        manifest = self.manifest()
+        if manifest is not None:
+            url_prefix = self.public_url_prefix()
+            return [URLScene(url_prefix + entry['metadata_path'],
+                             {band: url_prefix + path for band, path in entry['bands'].items()})
+                    for entry in manifest.query(**kwargs)]
         parts = [kwargs.pop(field, None)
                  for field in NormalizedSceneId.tuple_type._fields]
         prefixes = [self.prefix]
         for part in parts:
             if part is None:
-                prefixes = list(it.chain.from_iterable(map(self._iter_blobnames, prefixes)))
+                prefixes = list(it.chain.from_iterable(self._list_all(prefixes)))
             else:
                 if isinstance(part, str):
                     part = [part]
                 prefixes = list(pref + term + '/'
                                 for pref, term in it.product(prefixes, part))
         # If the last iteration did not query against the storage, we need to filter
-        # (query without the trailing /) to see if it exists
+        # (by listing the parent prefixes) to see if it exists
         if parts[-1] is not None:
-            prefixes = [pref for pref in prefixes
-                        if any(self._iter_blobnames(pref[:-1]))]
+            parents = sorted({pref[:pref.rindex('/', 0, -1) + 1] for pref in prefixes})
+            existing = set(it.chain.from_iterable(self._list_all(parents)))
+            prefixes = [pref for pref in prefixes if pref in existing]
 
         scenes = []
         for pref in prefixes:
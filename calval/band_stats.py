@@ -0,0 +1,94 @@
+"""
+Statistics of the valid pixels of a band, computed from its raw values: the valid pixels are
+compressed once, all order statistics are taken from one partition of them, and the affine
+scaling of the band is applied to the results (instead of to every pixel).
+"""
+import re
+from collections import OrderedDict
+import numpy as np
+
+default_stats = ('median', 'average', 'std')
+
+_quantile_stats = {'median': 0.5, 'min': 0.0, 'max': 1.0}
+_percentile_re = re.compile(r'^p(\d+(\.\d*)?)$')
+
+
+def _interpolated_quantile(take, count, q):
+    """
+    quantile `q` of `count` values, with the same indexes and interpolation as numpy's 'linear' method.
+    `take(indexes)` should return the values at `indexes` of the sorted values.
+    """
+    q = np.asanyarray(q, dtype=np.float64)
+    if count == 0:
+        return np.full(q.shape, np.nan)[()]
+    virtual_indexes = (count - 1) * q
+    previous_indexes = np.clip(np.floor(virtual_indexes), 0, count - 1).astype(np.int64)
+    next_indexes = np.minimum(previous_indexes + 1, count - 1)
+    gamma = virtual_indexes - previous_indexes
+    values = np.asarray(take(np.stack([previous_indexes, next_indexes])), dtype=np.float64)
+    previous, next_ = values[0], values[1]
+    diff = next_ - previous
+    result = np.where(gamma >= 0.5, next_ - diff * (1 - gamma), previous + diff * gamma)
+    return result[()]
+
+
+def stat_quantile(stat):
+    """
+    :return: the quantile of an order statistic name ('median', 'min', 'max' or 'p<percentile>',
+       e.g. 'p5', 'p97.5'), or None for other statistics
+    """
+    if stat in _quantile_stats:
+        return _quantile_stats[stat]
+    match = _percentile_re.match(stat)
+    if match:
+        percentile = float(match.group(1))
+        if percentile > 100:
+            raise ValueError('Invalid percentile: {}'.format(stat))
+        return percentile / 100
+    if stat not in ('average', 'std', 'count'):
+        raise ValueError('Unknown statistic: {}'.format(stat))
+    return None
+
+
+def band_stats(image, scale=None, stats=default_stats):
+    """
+    Statistics of the valid pixels of `image` (masked array, typically of the raw values of a band).
+    :param scale: (multiply, add) scaling to apply to the statistics (as `SceneData.scale_image` does to pixels),
+       None for unscaled values
+    :param stats: names of the statistics: 'median', 'average', 'std', 'min', 'max', 'count' and
+       percentiles 'p<percentile>' (e.g. 'p5', 'p97.5')
+    :return: OrderedDict of the values of `stats`
+    """
+    multiply, add = (1.0, 0.0) if scale is None else scale
+    quantiles = OrderedDict((stat, stat_quantile(stat)) for stat in stats)
+    image = np.ma.asanyarray(image)
+    values = image.compressed()
+    if np.may_share_memory(values, image):
+        # unmasked images are compressed to a view, which should not be reordered
+        values = values.copy()
+    count = len(values)
+    order_stats = [stat for stat, q in quantiles.items() if q is not None]
+    if order_stats:
+        # a decreasing scaling reverses the order
+        raw_q = [quantiles[stat] if multiply >= 0 else 1 - quantiles[stat] for stat in order_stats]
+
+        def _take(indexes):
+            values.partition(np.unique(indexes))
+            return values[indexes]
+        raw_values = np.atleast_1d(_interpolated_quantile(_take, count, raw_q))
+        quantile_values = dict(zip(order_stats, raw_values * multiply + add))
+    if count and ('average' in quantiles or 'std' in quantiles):
+        average = values.mean(dtype=np.float64)
+    result = OrderedDict()
+    for stat in stats:
+        if stat == 'count':
+            result[stat] = count
+        elif count == 0:
+            result[stat] = np.nan
+        elif stat == 'average':
+            result[stat] = average * multiply + add
+        elif stat == 'std':
+            result[stat] = np.sqrt(np.mean(np.square(values - average))) * abs(multiply)
+        else:
+            result[stat] = quantile_values[stat]
+    return result
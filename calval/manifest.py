@@ -0,0 +1,186 @@
+"""
+Manifest (index) of a store of normalized scenes: a single json file in the root of the
+store, listing all scenes with a summary of their metadata and the paths of their files
+(relative to the root). Queries on the store can then be answered by one read of the manifest.
+"""
+import os
+import json
+import uuid
+import fnmatch
+import urllib.error
+import urllib.request
+from calval.normalized_scene import NormalizedSceneId, URLScene, band_names
+from calval.storage import FileStorage, utc_isoformat, footprint_bbox
+
+manifest_filename = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_entry(metadata, bands=band_names):
+    """
+    :param metadata: metadata dict of a normalized scene
+    :return: manifest entry of the scene
+    """
+    scene_id = NormalizedSceneId.from_str(metadata['scene_id'])
+    footprint = metadata.get('footprint')
+    return {
+        'scene_id': metadata['scene_id'],
+        'timestamp': utc_isoformat(metadata['timestamp']),
+        'cloud_cover': metadata.get('metadata', {}).get('cloud_cover'),
+        'bbox': list(footprint_bbox(footprint)) if footprint else None,
+        'satellite_class': metadata.get('satellite_class'),
+        'metadata_path': scene_id.metadata_path(),
+        'bands': {band: scene_id.band_path(band) for band in bands},
+    }
+
+
+class Manifest:
+    """
+    The scenes of a manifest (entries by scene_id), with local filtering.
+    """
+    def __init__(self, entries=()):
+        self.entries = {entry['scene_id']: entry for entry in entries}
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        assert data.get('version') == MANIFEST_VERSION, 'Unsupported manifest version'
+        return cls(data['scenes'])
+
+    def to_json(self):
+        return json.dumps({
+            'version': MANIFEST_VERSION,
+            'scenes': [self.entries[scene_id] for scene_id in sorted(self.entries)]
+        }, indent=1)
+
+    def add(self, metadata_list, bands=band_names):
+        for metadata in metadata_list:
+            entry = manifest_entry(metadata, bands)
+            self.entries[entry['scene_id']] = entry
+
+    def query(self, start=None, end=None, min_cloud_cover=None, max_cloud_cover=None, bbox=None, **kwargs):
+        """
+        Same arguments as `SceneCatalog.query` (field values may contain glob wildcards).
+        :return: list of matching entries, sorted by scene_id
+        """
+        fields = NormalizedSceneId.tuple_type._fields
+        choices = {}
+        for field in fields:
+            values = kwargs.pop(field, None)
+            if values is not None:
+                choices[field] = [values] if isinstance(values, str) else values
+        assert not kwargs, 'Unrecognized field names: {}'.format(kwargs)
+        start = start and utc_isoformat(start)
+        end = end and utc_isoformat(end)
+
+        def _matches(entry):
+            id_fields = dict(zip(fields, NormalizedSceneId.from_str(entry['scene_id']).str_tuple))
+            if not all(any(fnmatch.fnmatchcase(id_fields[field], value) for value in values)
+                       for field, values in choices.items()):
+                return False
+            if (start and entry['timestamp'] < start) or (end and entry['timestamp'] >= end):
+                return False
+            cloud_cover = entry['cloud_cover']
+            if min_cloud_cover is not None and (cloud_cover is None or cloud_cover < min_cloud_cover):
+                return False
+            if max_cloud_cover is not None and (cloud_cover is None or cloud_cover > max_cloud_cover):
+                return False
+            if bbox is not None:
+                if entry['bbox'] is None:
+                    return False
+                min_lon, min_lat, max_lon, max_lat = entry['bbox']
+                if max_lon < bbox[0] or max_lat < bbox[1] or min_lon > bbox[2] or min_lat > bbox[3]:
+                    return False
+            return True
+
+        return [self.entries[scene_id] for scene_id in sorted(self.entries) if _matches(self.entries[scene_id])]
+
+
+def write_manifest(base_dir=None, path=None):
+    """
+    Write (atomically) the manifest of all normalized scenes of a local FileStorage folder
+    :return: path of the manifest file
+    """
+    storage = FileStorage(base_dir) if base_dir is not None else FileStorage()
+    manifest = Manifest()
+    manifest.add(scene.metadata for scene in storage.query(refresh=True))
+    if path is None:
+        path = os.path.join(storage.base_dir, manifest_filename)
+    tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(tmp_path, 'w') as f:
+        f.write(manifest.to_json())
+    os.replace(tmp_path, path)
+    return path
+
+
+def _is_url(location):
+    return '://' in location
+
+
+class ManifestStorage:
+    """
+    Read-only storage of normalized scenes, queried via its manifest.
+    `location` is the root of the store: either a url prefix (http(s)://, file://), or a
+    local folder. The manifest is re-read only when changed (by ETag / Last-Modified for urls,
+    by mtime for local files).
+    """
+    def __init__(self, location, manifest_name=manifest_filename):
+        if not location.endswith('/'):
+            location += '/'
+        self.location = location
+        self.manifest_name = manifest_name
+        self._manifest = None
+        self._version = None
+        self.stats = {'reads': 0, 'refreshes': 0}
+
+    def _read_local(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            with open(path) as f:
+                self._manifest = Manifest.from_json(f.read())
+            self._version = version
+            self.stats['reads'] += 1
+
+    def _read_url(self, url):
+        request = urllib.request.Request(url)
+        if self._version is not None:
+            etag, last_modified = self._version
+            if etag:
+                request.add_header('If-None-Match', etag)
+            if last_modified:
+                request.add_header('If-Modified-Since', last_modified)
+        try:
+            with urllib.request.urlopen(request) as f:
+                text = f.read().decode('utf-8')
+                version = (f.headers.get('ETag'), f.headers.get('Last-Modified'))
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return
+            raise
+        self._manifest = Manifest.from_json(text)
+        self._version = version
+        self.stats['reads'] += 1
+
+    @property
+    def manifest(self):
+        """
+        The manifest, refreshed if changed
+        """
+        self.stats['refreshes'] += 1
+        path = self.location + self.manifest_name
+        if _is_url(self.location):
+            self._read_url(path)
+        else:
+            self._read_local(path)
+        return self._manifest
+
+    def query(self, **kwargs):
+        """
+        Same arguments as `SceneCatalog.query`
+        :return: list of URLScene
+        """
+        metadata_prefix = self.location if _is_url(self.location) else 'file://' + os.path.abspath(self.location) + '/'
+        return [URLScene(metadata_prefix + entry['metadata_path'],
+                         {band: self.location + path for band, path in entry['bands'].items()})
+                for entry in self.manifest.query(**kwargs)]
@@ -10,8 +10,14 @@ import glob
 from collections import namedtuple
 from functools import total_ordering
 import json
+import time
+import threading
 import datetime as dt
+import http.client
+import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 import telluric as tl
 from calval.utils import cached_property
 from calval.raster_utils import hires_tile, TileCache, uncached_get_tile, asfloat
@@ -130,9 +136,9 @@ class NormalizedScene:
         return asfloat(tl.GeoRaster2.open(self.band_urls[band]))
 
     def band_tile(self, band, tile_coords, zoomlevel=None,
-                  get_tile=uncached_get_tile, decode=True):
+                  get_tile=uncached_get_tile, decode=True, max_workers=None, engine='tiles'):
         return hires_tile(self.band_urls[band], tile_coords, zoomlevel,
-                          get_tile=get_tile, decode=decode)
+                          get_tile=get_tile, decode=decode, max_workers=max_workers, engine=engine)
 
 
 class URLScene(NormalizedScene):
@@ -145,8 +151,11 @@ class URLScene(NormalizedScene):
         `band_urls` is either an explicit dict, or a prefix url from which
         the band urls can be generated by appending the filenames. The default
         is to copy that prefix from the `metadata_url`.
+        `band_headers` is the dict of the HTTP headers of the band urls (by band), when fetched by
+        `load_url_scenes`, otherwise None.
         """
         self._metadata_url = metadata_url
+        self.band_headers = None
         if band_urls is None:
             self._band_base_url = metadata_url.rsplit('/', maxsplit=1)[0]
         elif isinstance(band_urls, str):
@@ -169,6 +178,119 @@ class URLScene(NormalizedScene):
         return band_urls
 
 
+class _ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, one per host in each thread
+    """
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc):
+        connections = self._local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = connections[(scheme, netloc)] = conn_class(netloc, timeout=self.timeout)
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def request(self, method, url):
+        """
+        :return: (status, headers, body)
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        conn = self._connection(parts.scheme, parts.netloc)
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # the connection may have been closed by the server, reconnect on next request
+            conn.close()
+            raise
+        return response.status, response.headers, body
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+_redirect_statuses = (301, 302, 303, 307, 308)
+
+
+def _fetch(pool, method, url, retries, backoff, max_redirects=10):
+    """
+    :return: (headers, body) of the url, retrying on connection errors and server errors,
+    and following up to `max_redirects` redirects (a redirect to another host uses a connection to that host)
+    """
+    if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+        with urllib.request.urlopen(urllib.request.Request(url, method=method)) as f:
+            return f.headers, f.read()
+    for attempt in range(retries + 1):
+        try:
+            status, headers, body = pool.request(method, url)
+            if status < 500:
+                break
+            error = urllib.error.HTTPError(url, status, 'Server error', headers, None)
+        except (http.client.HTTPException, OSError) as e:
+            error = e
+        if attempt == retries:
+            raise error
+        time.sleep(backoff * 2 ** attempt)
+    if status in _redirect_statuses and headers.get('Location'):
+        if max_redirects == 0:
+            raise urllib.error.HTTPError(url, status, 'Too many redirects', headers, None)
+        if status == 303 and method != 'HEAD':
+            method = 'GET'
+        location = urllib.parse.urljoin(url, headers['Location'])
+        return _fetch(pool, method, location, retries, backoff, max_redirects - 1)
+    if status != 200:
+        raise urllib.error.HTTPError(url, status, 'Request failed', headers, None)
+    return headers, body
+
+
+def load_url_scenes(scenes, max_workers=16, retries=3, backoff=0.1, prefetch_bands=False):
+    """
+    Fetch the metadata of many `URLScene`s concurrently (by up to `max_workers` threads,
+    reusing keep-alive connections), and set their `metadata` property.
+    Failed requests are retried up to `retries` times, with exponential backoff.
+    If `prefetch_bands` is specified, the HTTP headers of all band urls are also fetched
+    (HEAD requests), and set as the `band_headers` dict of each scene.
+    :return: `scenes`
+    """
+    pool = _ConnectionPool()
+
+    def _load(scene):
+        if 'metadata' not in scene.__dict__:
+            _, body = _fetch(pool, 'GET', scene._metadata_url, retries, backoff)
+            scene.metadata = json.loads(body.decode('utf-8'))
+
+    def _head(scene_band):
+        scene, band = scene_band
+        return _fetch(pool, 'HEAD', scene.band_urls[band], retries, backoff)[0]
+
+    try:
+        with ThreadPoolExecutor(max_workers) as executor:
+            list(executor.map(_load, scenes))
+            if prefetch_bands:
+                scene_bands = [(scene, band) for scene in scenes for band in scene.band_urls]
+                all_headers = executor.map(_head, scene_bands)
+                for scene in scenes:
+                    scene.band_headers = {}
+                for (scene, band), headers in zip(scene_bands, all_headers):
+                    scene.band_headers[band] = headers
+    finally:
+        pool.close()
+    return scenes
+
+
 class FilebasedScene(NormalizedScene):
     "Lazy NormalizedScene that is read from files"
     def __init__(self, path, band_urls=None):
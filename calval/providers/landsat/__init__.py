@@ -11,10 +11,10 @@ from calval.geometry import IncidenceAngle
 from calval.normalized_scene import band_names
 from calval.sun_locator import SunLocator
 from calval.satellites.srf import Landsat8Blue, Landsat8Green, Landsat8Red, Landsat8Nir
-from calval.analysis import srf_exatmospheric_irradiance
+from calval.analysis import multiband_exatmospheric_irradiance
 from calval.providers import SceneData, SceneInfo
 from calval.providers.scene_info import extract_archive, scaling
-from .landsat_mtl import read_mtl, ephemeris_df
+from .landsat_mtl import cached_parse_odl, ephemeris_df
 
 _site_prs = {
     'baotou': ['128032', '127032'],
@@ -59,14 +59,23 @@ def _displayid_str(displayid):
     return '_'.join(fld or '*' for fld in displayid[:7])
 
 
-class LandsatSceneData(SceneData):
-    # ex_irradiance, in W/(m^2 nm sr)
-    band_ex_irradiance = {
-        _band_aliases['toa']['blue']: srf_exatmospheric_irradiance(Landsat8Blue()),
-        _band_aliases['toa']['green']: srf_exatmospheric_irradiance(Landsat8Green()),
-        _band_aliases['toa']['red']: srf_exatmospheric_irradiance(Landsat8Red()),
-        _band_aliases['toa']['nir']: srf_exatmospheric_irradiance(Landsat8Nir()),
+@functools.lru_cache(maxsize=1)
+def _band_ex_irradiance():
+    band_srfs = {
+        _band_aliases['toa']['blue']: Landsat8Blue(),
+        _band_aliases['toa']['green']: Landsat8Green(),
+        _band_aliases['toa']['red']: Landsat8Red(),
+        _band_aliases['toa']['nir']: Landsat8Nir(),
     }
+    return dict(zip(band_srfs, multiband_exatmospheric_irradiance(list(band_srfs.values()))))
+
+
+class LandsatSceneData(SceneData):
+    @property
+    def band_ex_irradiance(self):
+        # ex_irradiance, in W/(m^2 nm sr); computed on first use, as it requires the solar spectrum
+        return _band_ex_irradiance()
+
     # calculated the following backwards from 4 scenes of negev
     est_band_ex_irradiance = {
         _band_aliases['toa']['blue']: 2.01959,
@@ -93,7 +102,7 @@ class LandsatSceneData(SceneData):
         return os.path.join(self.path, self.l1_sceneinfo.l1_mtl_filename())
 
     def _read_l1_metadata(self):
-        self.l1_metadata = meta = read_mtl(self._mtl_path())['L1_METADATA_FILE']
+        self.l1_metadata = meta = cached_parse_odl(self._mtl_path())['L1_METADATA_FILE']
 
         data = meta['PRODUCT_METADATA']
         timestamp = dateutil.parser.parse(
@@ -142,7 +151,7 @@ class LandsatSceneData(SceneData):
         # * Azimuth can be computed from image corners
         #   https://gis.stackexchange.com/questions/98425/calculate-actual-landsat-image-corner-coordinates-to-derive-azimuth-heading?rq=1
         self.sat_average_angle = IncidenceAngle(180, 90)
-        self.angle_metadata = meta = read_mtl(self._ang_path())
+        self.angle_metadata = meta = cached_parse_odl(self._ang_path())
         df = ephemeris_df(meta)
         self.sat_coords = list(df.iloc[df.index.get_loc(self.timestamp, method='nearest')])
         # TODO: get view angles per point from angles file
@@ -174,15 +183,15 @@ class LandsatSceneData(SceneData):
                 assert scaling == _scale_values['toa_raw']
             return scaling
 
-    def scale_image(self, image, band, product=None):
+    def affine_scale(self, band, product=None):
         if product is None:
             product = self.sceneinfo.product
         if product == 'toa':
-            img_raw = super().scale_image(image, band, 'toa_raw')
+            raw_scale = super().affine_scale(band, 'toa_raw')
             factor = np.sin(self.sun_average_angle.elevation * np.pi / 180)
-            return img_raw / factor
+            return scaling(raw_scale.multiply / factor, raw_scale.add / factor)
         else:
-            return super().scale_image(image, band, product)
+            return super().affine_scale(band, product)
 
 
 class LandsatSceneInfo(SceneInfo):
@@ -206,13 +215,18 @@ class LandsatSceneInfo(SceneInfo):
             self.products.append('irradiance')
             self.products.append('toa_raw')
 
-    @property
-    def extract_archive(self):
-        extract = functools.partial(
-            extract_archive,
-            self.archive_path(), self.scene_path(),
-            mkdir=True, opener=functools.partial(tarfile.open, mode='r:gz'))
-        return extract
+    def extract_archive(self, bands=None):
+        """
+        extract the scene, or if `bands` are specified, only its metadata and those bands
+        """
+        extract_archive(self.archive_path(), self.scene_path(), mkdir=True,
+                        opener=functools.partial(tarfile.open, mode='r:gz'),
+                        members=None if bands is None else self.archive_members(bands))
+
+    def archive_members(self, bands):
+        extension = 'TIF' if self.product == 'toa' else 'tif'
+        return ['*_MTL.txt', '*_ANG.txt', '*.xml'] + [
+            '*_{}.{}'.format(self.band_name(band), extension) for band in bands]
 
     @classmethod
     def from_l2_sceneid(cls, sid, config):
@@ -1,11 +1,73 @@
+import re
 import datetime as dt
 from collections import OrderedDict
 
 import dateutil.parser
+import numpy as np
 import pandas as pd
+from calval.utils.sidecar import cached_parse
 
+# Bump this whenever the output of `parse_odl` changes, to invalidate cached sidecars
+ODL_PARSER_VERSION = '2'
 
-# TODO: rename to parse_odl_file or similar (MTL & ANG files are both in ODL format)
+# `NAME = value` statements, where value is a quoted string, a (possibly multi-line) list, or a single word
+_statement_re = re.compile(r'^[ \t]*(\w+)[ \t]*=[ \t]*("[^"]*"|\([^)]*\)|\S+)', re.MULTILINE)
+# the ODL `END` statement, after which the file content is ignored
+_end_re = re.compile(r'^[ \t]*END[ \t]*$', re.MULTILINE | re.IGNORECASE)
+# items of a list: quoted strings (which may contain commas), or unquoted values
+_list_item_re = re.compile(r'"[^"]*"|[^\s,"][^,"]*')
+_int_re = re.compile(r'^[+-]?\d+$')
+_datetime_re = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _parse_datetime(val):
+    try:
+        # fast path for ISO dates / times (python<3.11 does not accept the Z suffix)
+        return dt.datetime.fromisoformat(val[:-1] + '+00:00' if val.endswith('Z') else val)
+    except ValueError:
+        return dateutil.parser.parse(val)
+
+
+def _parse_list(val):
+    """
+    parse the inside of an ODL list: numbers are returned as a numpy array,
+    other lists (e.g. of quoted strings) as a list of values
+    """
+    if '"' in val:
+        return [_parse_value(item.rstrip()) for item in _list_item_re.findall(val)]
+    items = val.split(',')
+    if not val.strip():
+        return np.array([])
+    dtype = int if all(_int_re.match(item.strip()) for item in items) else float
+    return np.array(items, dtype=dtype)
+
+
+def _list_values(val):
+    """
+    parse the inside of an ODL list into a list of values, each number being an int or a float on its own
+    """
+    if '"' in val:
+        return _parse_list(val)
+    return [int(item) if _int_re.match(item) else float(item) for item in (x.strip() for x in val.split(','))
+            if item]
+
+
+def _parse_value(val):
+    if val.startswith('"'):
+        return val[1:-1]
+    if val.startswith('('):
+        return _parse_list(val[1:-1])
+    if _int_re.match(val):
+        return int(val)
+    if _datetime_re.match(val):
+        return _parse_datetime(val)
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+
+# Note: MTL & ANG files are both in ODL format, see also the faster `parse_odl`
 def read_mtl(path):
     context = OrderedDict()
     stack = [('/', context)]
@@ -18,7 +80,7 @@ def read_mtl(path):
             val = line.strip()
             if val.endswith(')'):
                 val = unfinished_list_val + val
-                context[tag] = eval('[{}]'.format(val[1:-1]))  # noqa: F821
+                context[tag] = _list_values(val[1:-1])
                 unfinished_list_val = None
             else:
                 assert val.endswith(',')
@@ -45,8 +107,7 @@ def read_mtl(path):
             context[tag] = val[1:-1]
         elif val.startswith('('):
             if val.endswith(')'):
-                # TODO: avoid eval (should be list specific)
-                context[tag] = eval('[{}]'.format(val[1:-1]))
+                context[tag] = _list_values(val[1:-1])
             else:
                 assert val.endswith(',')
                 unfinished_list_val = val
@@ -63,6 +124,40 @@ def read_mtl(path):
     return context
 
 
+def parse_odl(path):
+    """
+    Same as `read_mtl`, but faster: numeric lists are parsed into numpy arrays
+    """
+    with open(path, 'rt') as f:
+        text = f.read()
+    end = _end_re.search(text)
+    context = OrderedDict()
+    stack = [('/', context)]
+    for match in _statement_re.finditer(text, 0, len(text) if end is None else end.start()):
+        tag, val = match.groups()
+        tag_lower = tag.lower()
+        if tag_lower == 'group':
+            assert val not in context
+            context[val] = OrderedDict()
+            context = context[val]
+            stack.append((val, context))
+        elif tag_lower == 'end_group':
+            while stack[-1][0] != val:
+                del stack[-1]
+            del stack[-1]
+            context = stack[-1][1]
+        else:
+            context[tag] = _parse_value(val)
+    return stack[0][1]
+
+
+def cached_parse_odl(path):
+    """
+    Same as `parse_odl`, cached in a json sidecar file
+    """
+    return cached_parse(path, parse_odl, key='parse_odl:{}'.format(ODL_PARSER_VERSION))
+
+
 def ephemeris_df(angles_metadata):
     """
     Read the EPHEMERIS block of the angles metadata file
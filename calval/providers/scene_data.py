@@ -5,21 +5,21 @@ import json
 from abc import ABC, abstractmethod
 from collections import OrderedDict
 import datetime as dt
+import functools
 import numpy as np
 import rasterio as rio
 import telluric as tl
 from calval.normalized_scene import band_names, NormalizedSceneId
 from calval.analysis import toa_irradiance_to_reflectance
+from calval.raster_utils import read_aoi, BandCache
+from calval.band_stats import band_stats, default_stats
+from calval.storage import FileStorage
 from .scene_info import SceneInfo
 
 
 logger = logging.getLogger(__name__)
 
 
-def _stats(img):
-    return np.ma.median(img), np.ma.average(img), np.ma.std(img)
-
-
 def set_zero_nodata(raster):
     """
     Mask out any pixels which have value=0 (in addition to previously masked pixels)
@@ -53,11 +53,31 @@ def save_with_nodata(raster, path, resampling=rio.enums.Resampling.cubic):
         r.update_tags(ns='rio_overview', resampling=resampling.name)
 
 
+def _band_raster(path, dataset, aoi):
+    # both L8 and S2 use nodata=0, but do not mark it in the metadata, so telluric does not
+    # load them properly. Fix that explicitly (mainly for landsat, as sentinel images do not
+    # normally contain nodata pixels).
+    if aoi is None:
+        return set_zero_nodata(tl.georaster.GeoRaster2.open(path))
+    # only read the window covering the aoi, masking nodata and outside pixels while reading
+    return read_aoi(dataset, aoi, nodata=0)
+
+
+@functools.lru_cache(maxsize=None)
+def _band_cache(folder, max_bytes):
+    # one instance per process, so that its stats are shared by all scenes
+    return BandCache(folder, max_bytes)
+
+
 class SceneData(ABC):
     """
     Base class for provider-specific scene data, represented as an unpacked directory,
     with metadata and image files.
     """
+    # whether the band files are slow to decode, and should be read from the band cache
+    # (when configured by the `band_cache` folder of the sceneinfo config)
+    cache_bands = False
+
     @abstractmethod
     def __init__(self, sceneinfo, path=None):
         assert sceneinfo.scenedata_class == self.__class__, 'Invalid direct constructor call'
@@ -85,32 +105,59 @@ class SceneData(ABC):
             path = paths[0]
         return path
 
+    def rasters(self, band, aois):
+        """
+        get the rasters of relevant band, cropped to each of the `aois`
+        (`None` stands for the whole raster). The band file is opened once for all aois.
+        """
+        path = self.get_band_path(band)
+        band_cache = self.band_cache
+        if band_cache is not None:
+            path = band_cache.get(path)
+        with rio.open(path) as dataset:
+            return [_band_raster(path, dataset, aoi) for aoi in aois]
+
+    @property
+    def band_cache(self):
+        """
+        The `BandCache` of the band files, or None if not used
+        """
+        folder = self.sceneinfo.config.get('band_cache')
+        if folder is None or not self.cache_bands:
+            return None
+        return _band_cache(folder, self.sceneinfo.config.get('band_cache_max_bytes'))
+
+    def ingest(self, bands=band_names):
+        """
+        transcode the files of `bands` into the band cache (if used), ahead of reading them
+        """
+        band_cache = self.band_cache
+        if band_cache is not None:
+            for band in bands:
+                band_cache.get(self.get_band_path(band))
+
     def raster(self, band, aoi=None):
         """
         get the raster for relevant band
         `aoi` may be specified to avoid reading the whole raster
         """
-        path = self.get_band_path(band)
-        raster = tl.georaster.GeoRaster2.open(path)
-        if aoi is not None:
-            raster = raster.crop(aoi)
-        # both L8 and S2 use nodata=0, but do not mark it in the metadata, so telluric does not
-        # load them properly. Fix that explicitly (mainly for landsat, as sentinel images do not
-        # normally contain nodata pixels).
-        raster = set_zero_nodata(raster)
-        if aoi is not None:
-            raster = raster.mask(aoi)
-        return raster
+        return self.rasters(band, [aoi])[0]
 
     # Note: for landsat, we override this to provide corrected toa as well as toa_raw
+    def affine_scale(self, band, product=None):
+        """
+        :return: the scaling (multiply, add) from the raw values of the band to the values of `product`
+        """
+        if product is None:
+            product = self.sceneinfo.product
+        return self.get_scale(band, product)
+
     def scale_image(self, image, band, product=None):
         """
         scale the image according to the appropriate scaling factor
         from the metadata
         """
-        if product is None:
-            product = self.sceneinfo.product
-        scale = self.get_scale(band, product)
+        scale = self.affine_scale(band, product)
         float_image = image * scale.multiply + scale.add
         return float_image
 
@@ -131,30 +178,43 @@ class SceneData(ABC):
         raster = raster.copy_with(image=img)
         return raster
 
-    def extract_values(self, aoi, bands=band_names, product=None):
-        row = OrderedDict()
+    def extract_values(self, aoi, bands=band_names, product=None, stats=default_stats):
+        return self.extract_multi_values([aoi], bands, product, stats)[0]
+
+    def extract_multi_values(self, aois, bands=band_names, product=None, stats=default_stats):
+        """
+        Same as `extract_values`, for a list of `aois` (reading each band once).
+        `stats` are the names of the statistics to extract (see `calval.band_stats.band_stats`)
+        :return: list of rows, one per aoi
+        """
+        rows = [OrderedDict() for aoi in aois]
         for band in bands:
-            img = self.float_image(band, product, aoi)
-            med, avg, std = _stats(img)
-            logger.debug('extracted values: med=%s, avg=%s, std=%s', med, avg, std)
-            row['{}_median'.format(band)] = med
-            row['{}_average'.format(band)] = avg
-            row['{}_std'.format(band)] = std
-        return row
-
-    def extract_computed_toa(self, aoi, bands=band_names, corrected=False):
-        irradiance_row = self.extract_values(aoi, bands, 'irradiance')
+            scale = self.affine_scale(band, product)
+            for row, raster in zip(rows, self.rasters(band, aois)):
+                values = band_stats(raster.image, scale, stats)
+                logger.debug('extracted values: %s', dict(values))
+                for stat, value in values.items():
+                    row['{}_{}'.format(band, stat)] = value
+        return rows
+
+    def extract_computed_toa(self, aoi, bands=band_names, corrected=False, stats=default_stats):
+        return self.extract_multi_computed_toa([aoi], bands, corrected, stats)[0]
+
+    def extract_multi_computed_toa(self, aois, bands=band_names, corrected=False, stats=default_stats):
+        irradiance_rows = self.extract_multi_values(aois, bands, 'irradiance', stats)
         ignore_sun_zenith = not corrected
-        row = OrderedDict()
+        rows = [OrderedDict() for aoi in aois]
         for band in bands:
             bandname = self.sceneinfo.band_name(band)
             reflectance_per_unit = toa_irradiance_to_reflectance(
                 1.0, self.band_ex_irradiance[bandname],
                 self.center_sunpos, self.timestamp, ignore_sun_zenith=ignore_sun_zenith)
-            for stat in ['median', 'average', 'std']:
-                prop_name = '{}_{}'.format(band, stat)
-                row[prop_name] = reflectance_per_unit * irradiance_row[prop_name]
-        return row
+            for row, irradiance_row in zip(rows, irradiance_rows):
+                for stat in stats:
+                    prop_name = '{}_{}'.format(band, stat)
+                    factor = 1 if stat == 'count' else reflectance_per_unit
+                    row[prop_name] = factor * irradiance_row[prop_name]
+        return rows
 
     def json_params(self, product=None):
         if product is None:
@@ -218,4 +278,6 @@ class SceneData(ABC):
         path = os.path.join(dirname, '{}_metadata.json'.format(scene_id))
         with open(path, 'w') as f:
             json.dump(params, f, indent=4)
+        # keep the catalog of the normalized folder (if any) up to date
+        FileStorage(self.sceneinfo._data_path('normalized')).add_scenes([path])
         return path
@@ -3,8 +3,13 @@ Module should contain the base SceneInfo class, plus other stuff which is useful
 for implementing the provider-specific specializations
 """
 import os
+import glob
+import fnmatch
+import posixpath
+import tarfile
 import datetime as dt
 import collections
+import importlib
 import warnings
 import calval.config
 
@@ -12,8 +17,38 @@ import calval.config
 scaling = collections.namedtuple('scaling', ['multiply', 'add'])
 noscale = scaling(1, 0)
 
+# Modules of the provider-specific SceneInfo subclasses. They are imported on first use
+# of the `SceneInfo.from_filename` / `SceneInfo.from_foldername` factories.
+provider_modules = ['calval.providers.sentinel', 'calval.providers.landsat']
 
-def extract_archive(input_path, output_path, mkdir, opener):
+
+def register_provider(module_name):
+    """
+    Register a module implementing a SceneInfo subclass, to be used by the factory methods
+    """
+    if module_name not in provider_modules:
+        provider_modules.append(module_name)
+
+
+def _import_providers():
+    for module_name in provider_modules:
+        importlib.import_module(module_name)
+
+
+def _archive_members(archive):
+    """
+    :return: list of (name, member) of a zip/tar archive, names normalized
+    """
+    if isinstance(archive, tarfile.TarFile):
+        return [(posixpath.normpath(member.name), member) for member in archive.getmembers() if member.isfile()]
+    return [(posixpath.normpath(name), name) for name in archive.namelist() if not name.endswith('/')]
+
+
+# marker file of partially extracted scene folders
+partial_marker = '.calval_partial'
+
+
+def extract_archive(input_path, output_path, mkdir, opener, members=None):
     """
     `output_path` should contain the full folder name of the scene, as it should appear
     after extraction.
@@ -24,18 +59,50 @@ def extract_archive(input_path, output_path, mkdir, opener):
     Otherwise it is assumed that the archive contains relative paths (including the base
     folder name), so the archive is opened in the dirname `output_path`.
     In this case the basename of the path is only used for checking if it existed before.
+
+    `members` may specify glob patterns of the files to extract (relative to the scene folder).
+    Then only the patterns which have no matching file in `output_path` are extracted
+    (so an existing folder is completed with the missing files), and the folder is marked
+    as partial (by a `partial_marker` file). A full extraction of a partial folder extracts
+    the missing files.
     """
-    if os.path.isdir(output_path):
-        warnings.warn('{} already exists, not extracting'.format(output_path))
-        return
+    marker_path = os.path.join(output_path, partial_marker)
+    partial = os.path.isfile(marker_path)
+    if members is None:
+        if os.path.isdir(output_path) and not partial:
+            warnings.warn('{} already exists, not extracting'.format(output_path))
+            return
+    else:
+        members = [pattern for pattern in members if not glob.glob(os.path.join(output_path, pattern))]
+        if not members:
+            return
 
+    scene_path = output_path
     if mkdir:
-        os.mkdir(output_path)
+        os.makedirs(output_path, exist_ok=True)
+        prefix = ''
     else:
+        prefix = os.path.basename(output_path) + '/'
         output_path = os.path.dirname(output_path)
 
     with opener(input_path) as archive:
-        archive.extractall(output_path)
+        if members is None and not partial:
+            archive.extractall(output_path)
+        else:
+            if members is None:
+                # complete the partial folder
+                selected = [member for name, member in _archive_members(archive) if name.startswith(prefix) and
+                            not os.path.exists(os.path.join(output_path, name))]
+            else:
+                selected = [member for name, member in _archive_members(archive) if name.startswith(prefix) and
+                            any(fnmatch.fnmatchcase(name[len(prefix):], pattern) for pattern in members)]
+            archive.extractall(output_path, members=selected)
+    if members is None:
+        if partial:
+            os.remove(marker_path)
+    elif not partial:
+        os.makedirs(scene_path, exist_ok=True)
+        open(marker_path, 'w').close()
 
 
 class SceneInfo:
@@ -49,7 +116,10 @@ class SceneInfo:
         data_dir=calval.config.data_dir,
         scenes=None,
         archives=calval.config.dl_dir,
-        normalized=calval.config.normalized_dir
+        normalized=calval.config.normalized_dir,
+        # folder of transcoded band files (see `SceneData.band_cache`), None to read the original files
+        band_cache=None,
+        band_cache_max_bytes=None
     )
     product_units = {
         'sr': None, 'toa': None
@@ -94,6 +164,7 @@ class SceneInfo:
 
     @classmethod
     def from_filename(cls, filename, config=None):
+        _import_providers()
         for c in cls.__subclasses__():
             scene_info = c.from_filename(filename, config)
             if scene_info is not None:
@@ -102,6 +173,7 @@ class SceneInfo:
 
     @classmethod
     def from_foldername(cls, foldername, config=None):
+        _import_providers()
         for c in cls.__subclasses__():
             scene_info = c.from_foldername(foldername, config)
             if scene_info is not None:
@@ -127,3 +199,10 @@ class SceneInfo:
 
     def is_scene(self):
         return os.path.isdir(self.scene_path())
+
+    def archive_members(self, bands):
+        """
+        :return: glob patterns of the files (relative to the scene folder) needed for reading
+           the metadata and `bands` of the scene, or None if all files are needed
+        """
+        return None
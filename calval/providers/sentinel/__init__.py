@@ -8,10 +8,11 @@ import numpy as np
 from calval.geometry import IncidenceAngle
 from calval.normalized_scene import band_names
 from calval.satellites.srf import Sentinel2Blue, Sentinel2Green, Sentinel2Red, Sentinel2Nir
-from calval.analysis import srf_exatmospheric_irradiance
+from calval.analysis import multiband_exatmospheric_irradiance
 from calval.providers import SceneInfo, SceneData
 from calval.providers.scene_info import extract_archive, scaling
-from .sentinel_xml import parse_tile_metadata, parse_xml_metadata
+from calval.utils import cached_property
+from .sentinel_xml import cached_parse_selected, parse_tile_metadata, parse_xml_metadata
 
 _product_names = {
     'MSIL1C': 'toa',
@@ -57,13 +58,39 @@ sentinelid = collections.namedtuple(
     ['mission', 'product', 'captime', 'grid_n', 'grid_r', 'box', 'othertime'])
 
 
-class SentinelSceneData(SceneData):
-    band_ex_irradiance = {
-        _band_aliases['blue']: srf_exatmospheric_irradiance(Sentinel2Blue()),
-        _band_aliases['green']: srf_exatmospheric_irradiance(Sentinel2Green()),
-        _band_aliases['red']: srf_exatmospheric_irradiance(Sentinel2Red()),
-        _band_aliases['nir']: srf_exatmospheric_irradiance(Sentinel2Nir())
+@functools.lru_cache(maxsize=1)
+def _band_ex_irradiance():
+    band_srfs = {
+        _band_aliases['blue']: Sentinel2Blue(),
+        _band_aliases['green']: Sentinel2Green(),
+        _band_aliases['red']: Sentinel2Red(),
+        _band_aliases['nir']: Sentinel2Nir()
     }
+    return dict(zip(band_srfs, multiband_exatmospheric_irradiance(list(band_srfs.values()))))
+
+
+# the parts of the metadata files which are read (see `sentinel_xml.parse_selected`)
+product_metadata_paths = [
+    'General_Info/Product_Image_Characteristics/Reflectance_Conversion',
+    'Geometric_Info/Product_Footprint',
+    'Quality_Indicators_Info/Cloud_Coverage_Assessment',
+]
+tile_metadata_paths = [
+    'General_Info/SENSING_TIME',
+    'Geometric_Info/Tile_Angles/Sun_Angles_Grid',
+    'Geometric_Info/Tile_Angles/Mean_Sun_Angle',
+    'Geometric_Info/Tile_Angles/Mean_Viewing_Incidence_Angle_List',
+]
+
+
+class SentinelSceneData(SceneData):
+    # JPEG2000 decoding is slow
+    cache_bands = True
+
+    @property
+    def band_ex_irradiance(self):
+        # computed on first use, as it requires the solar spectrum
+        return _band_ex_irradiance()
 
     def __init__(self, sceneinfo, path=None):
         super().__init__(sceneinfo, path)
@@ -77,8 +104,22 @@ class SentinelSceneData(SceneData):
     def _product_mtd_path(self):
         return os.path.join(self.path, 'MTD_{}.xml'.format(self.sceneinfo._data.product))
 
+    @cached_property
+    def product_meta(self):
+        """
+        the full product metadata (parsed on first use, the scene itself reads only `product_metadata_paths`)
+        """
+        return parse_xml_metadata(self._product_mtd_path())
+
+    @cached_property
+    def metadata(self):
+        """
+        the full tile metadata (parsed on first use, the scene itself reads only `tile_metadata_paths`)
+        """
+        return parse_tile_metadata(self._granule_mtd_path())
+
     def _read_product_metadata(self):
-        self.product_meta = metadata = parse_xml_metadata(self._product_mtd_path())
+        metadata = cached_parse_selected(self._product_mtd_path(), product_metadata_paths)
         data = metadata['General_Info']['Product_Image_Characteristics']['Reflectance_Conversion']
         self.esuns = [
             data['Solar_Irradiance_List']['SOLAR_IRRADIANCE_{}'.format(
@@ -93,7 +134,7 @@ class SentinelSceneData(SceneData):
         self.cloud_coverage = metadata['Quality_Indicators_Info']['Cloud_Coverage_Assessment']
 
     def _read_l1_metadata(self):
-        self.metadata = metadata = parse_tile_metadata(self._granule_mtd_path())
+        metadata = cached_parse_selected(self._granule_mtd_path(), tile_metadata_paths)
         self.timestamp = metadata['General_Info']['SENSING_TIME']
 
         def _view_angle(bandid):
@@ -147,13 +188,23 @@ class SentinelSceneInfo(SceneInfo):
         self.product = _product_names[data.product]
         self.products = [self.product]
 
-    @property
-    def extract_archive(self):
-        extract = functools.partial(
-            extract_archive,
-            self.archive_path(), self.scene_path(),
-            mkdir=False, opener=zipfile.ZipFile)
-        return extract
+    def extract_archive(self, bands=None):
+        """
+        extract the scene, or if `bands` are specified, only its metadata and those bands
+        """
+        extract_archive(self.archive_path(), self.scene_path(), mkdir=False, opener=zipfile.ZipFile,
+                        members=None if bands is None else self.archive_members(bands))
+
+    def archive_members(self, bands):
+        members = ['MTD_*.xml', 'GRANULE/*/MTD_TL.xml']
+        for band in bands:
+            band = self.band_name(band)
+            if self.product == 'sr':
+                res = '{}m'.format(_band_resolutions[band])
+                members.append('GRANULE/*/IMG_DATA/R{1}/*_{0}_{1}.jp2'.format(band, res))
+            else:
+                members.append('GRANULE/*/IMG_DATA/*_{}.jp2'.format(band))
+        return members
 
     @classmethod
     def from_foldername(cls, fname, config):
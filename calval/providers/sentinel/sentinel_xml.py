@@ -1,6 +1,11 @@
 import re
 import xml.etree.ElementTree as ET
 import dateutil.parser
+import numpy as np
+from calval.utils.sidecar import cached_parse
+
+# Bump this whenever the output of `parse_selected` changes, to invalidate cached sidecars
+XML_PARSER_VERSION = '1'
 
 float_re = re.compile(r'\d+\.\d+$')
 
@@ -134,3 +139,57 @@ def parse_xml_metadata(xmlfile):
         name = block.tag.split('}')[-1]
         blocks[name] = elements2dict(block)
     return blocks
+
+
+def _local_name(tag):
+    return tag.split('}')[-1]
+
+
+def _grids_to_arrays(value):
+    """
+    convert the `Values_List` lists of the angle grids in `value` to numpy arrays
+    """
+    if isinstance(value, dict):
+        return {key: np.array(item, dtype=float) if key == 'Values_List' else _grids_to_arrays(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_grids_to_arrays(item) for item in value]
+    return value
+
+
+def parse_selected(xmlfile, paths):
+    """
+    Parse only the requested elements of a metadata file, by a streaming parse which drops
+    all other elements without converting them.
+    :param paths: element paths (below the root, by local names), e.g. 'Geometric_Info/Tile_Angles/Mean_Sun_Angle'
+    :return: nested dicts with the requested elements (as `elements2dict` would build them, with angle
+       grids values as numpy arrays)
+    """
+    targets = {tuple(path.split('/')) for path in paths}
+    blocks = {}
+    stack = []
+    for event, element in ET.iterparse(xmlfile, events=('start', 'end')):
+        if event == 'start':
+            stack.append(_local_name(element.tag))
+            continue
+        path = tuple(stack[1:])
+        stack.pop()
+        if path in targets:
+            parent = blocks
+            for name in path[:-1]:
+                parent = parent.setdefault(name, {})
+            for name, value in elements2dict([element]).items():
+                additem(parent, name, _grids_to_arrays(value))
+        # elements inside a requested one are kept until it is converted
+        if not any(path[:i] in targets for i in range(1, len(path))):
+            element.clear()
+    return blocks
+
+
+def cached_parse_selected(xmlfile, paths):
+    """
+    Same as `parse_selected`, cached in a json sidecar file
+    """
+    paths = sorted(paths)
+    return cached_parse(xmlfile, lambda path: parse_selected(path, paths),
+                        key=['parse_selected', XML_PARSER_VERSION, paths])
@@ -1,9 +1,24 @@
 import numpy as np
 import os.path
+import uuid
 import hashlib
 import itertools as it
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import rasterio as rio
+import rasterio.features
+import rasterio.shutil
+import rasterio.transform
+import rasterio.vrt
+import rasterio.windows
 import telluric as tl
 from calval.config import cache_dir
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 max_float_range = np.iinfo(np.uint16).max / (1 << 16)
 
@@ -13,43 +28,435 @@ def asfloat(raster_uint16):
     return raster_uint16.astype(float, out_range=(0, max_float_range))
 
 
+def aoi_window(dataset, aoi):
+    """
+    Pixel-aligned rasterio window of the open `dataset` covering the bounds of `aoi`,
+    clipped to the dataset extent. The window is computed as in telluric's `GeoRaster2.crop`
+    (bounds of the envelope of `aoi` in its own crs, offsets rounded down, lengths rounded as
+    by rasterio), so that the same pixels are selected.
+    """
+    bounds = aoi.envelope.get_bounds(dataset.crs)
+    window = rio.windows.from_bounds(*bounds, transform=dataset.transform)
+    # same as `round_shape(op='ceil')` in telluric, which is deprecated in rasterio
+    window = window.round_offsets(pixel_precision=3).round_lengths(op='ceil')
+    col_start, row_start = max(0, window.col_off), max(0, window.row_off)
+    col_stop = max(col_start, min(dataset.width, window.col_off + window.width))
+    row_stop = max(row_start, min(dataset.height, window.row_off + window.height))
+    return rio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def read_aoi(dataset, aoi, nodata=0):
+    """
+    Read from the open rasterio `dataset` only the window covering `aoi`.
+    The data is read directly into a masked array, where pixels with value `nodata`
+    and pixels outside the `aoi` geometry are masked.
+    :return: GeoRaster2
+    """
+    window = aoi_window(dataset, aoi)
+    shape = (dataset.count, window.height, window.width)
+    image = np.ma.masked_array(np.empty(shape, dtype=dataset.dtypes[0]), mask=np.empty(shape, dtype=bool))
+    dataset.read(out=image.data, window=window)
+    np.equal(image.data, nodata, out=image.mask)
+    affine = dataset.window_transform(window)
+    if window.width and window.height:
+        image.mask |= rio.features.geometry_mask(
+            [aoi.get_shape(dataset.crs)], out_shape=shape[1:], transform=affine)
+    return tl.GeoRaster2(image=image, affine=affine, crs=dataset.crs, nodata=nodata)
+
+
 def uncached_get_tile(url, coords):
     raster = tl.GeoRaster2.open(url)
     tile = raster.get_tile(*coords)
     return tile
 
 
+@contextmanager
+def _file_lock(path):
+    """
+    exclusive inter-process lock for creating the file `path` (a no-op where `fcntl` is not available)
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.lock')
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.path.isfile(path):
+                # a waiting process will find the file, so the lock file is not needed anymore
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _evict_lru(entries, max_size, keep_path):
+    """
+    Remove the least recently used of the cached files `entries` ((path, size, mtime) tuples),
+    except `keep_path`, until their total size is at most `max_size`.
+    :return: (total size of the remaining files, number of removed files)
+    """
+    entries = sorted(entries, key=lambda entry: entry[2])
+    total_size = sum(size for _, size, _ in entries)
+    evicted = 0
+    for path, size, _ in entries:
+        if total_size <= max_size:
+            break
+        if path == keep_path:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total_size -= size
+        evicted += 1
+    return total_size, evicted
+
+
 class TileCache:
-    def __init__(self, folder=os.path.join(cache_dir, 'tiles')):
+    """
+    Cache of tiles fetched by `fetch(url, coords)`, saved as GeoTIFF files in `folder`,
+    sharded to subfolders by the first 2 hex digits of the key.
+    The folder may be shared by several processes: files are written to a temporary name and
+    renamed into place, and a missing tile is fetched by one process only, while others wait
+    for it (per-key lock files, where `fcntl` is available).
+    If `max_bytes` is specified, the least recently used files are evicted whenever the total
+    size of the cached files exceeds it (the file mtime is updated on every hit), down to
+    `low_water * max_bytes`, so that the folder is rescanned only once per several misses.
+    The most recently used tiles are also kept in memory, up to `memory_bytes` of image data.
+    Hits, misses, evictions and eviction scans are counted in `stats`.
+    `get_tile` may be called concurrently from several threads.
+    Constructing the cache does not scan the folder: files of the older flat layout are moved
+    into their shards on first access (or by `migrate_flat_files`), and the total size of the
+    files is only computed (on the first miss) if `max_bytes` is specified.
+    """
+    def __init__(self, folder=os.path.join(cache_dir, 'tiles'), max_bytes=None, memory_bytes=64 << 20,
+                 fetch=uncached_get_tile, low_water=0.9):
         self.folder = folder
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.memory_bytes = memory_bytes
+        self.fetch = fetch
+        self.stats = Counter()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.RLock()
+        self._migrated = False
+        self._disk_size = None
+        os.makedirs(folder, exist_ok=True)
 
-    def get_tile(self, url, coords):
-        hash = hashlib.sha1('{}:{}'.format(url, coords).encode()).hexdigest()
-        path = os.path.join(self.folder, hash + '.tif')
-        if os.path.isfile(path):
+    @staticmethod
+    def _key(url, coords):
+        return hashlib.sha1('{}:{}'.format(url, coords).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key + '.tif')
+
+    def migrate_flat_files(self):
+        """
+        move files of the older, flat layout into their shard
+        """
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.tif'):
+                path = self._path(entry.name[:-len('.tif')])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try:
+                    os.replace(entry.path, path)
+                except FileNotFoundError:  # moved by another process
+                    pass
+        self._migrated = True
+
+    def _entries(self):
+        """
+        :return: list of (path, size, mtime) of the cached files
+        """
+        entries = []
+        for shard in os.scandir(self.folder):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                # skip temporary files and lock files
+                if entry.name.startswith('.') or not entry.name.endswith('.tif'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed by another process
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _key_lock(self, path):
+        """
+        exclusive inter-process lock for fetching the tile of `path`
+        """
+        return _file_lock(path)
+
+    def _read(self, path):
+        """
+        :return: the cached tile from `path`, or None if not found
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
             tile = tl.GeoRaster2.open(path)
-        else:
-            tile = uncached_get_tile(url, coords)
-            tile.save(path)
+            tile.image  # load before releasing the file to possible eviction
+        except tl.georaster.GeoRaster2IOError:  # evicted by another process
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
         return tile
 
+    def _write(self, path, tile):
+        tmp_path = os.path.join(os.path.dirname(path), '.{}.{}.tif'.format(os.path.basename(path), uuid.uuid4().hex))
+        try:
+            tile.save(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remember(self, key, tile):
+        if self.memory_bytes <= 0:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = tile
+        self._memory_size += tile.image.nbytes
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old_tile = self._memory.popitem(last=False)
+            self._memory_size -= old_tile.image.nbytes
+
+    def _evict(self, keep_path):
+        # rescan, as the folder may be shared with other processes
+        self._disk_size, evicted = _evict_lru(self._entries(), self.low_water * self.max_bytes, keep_path)
+        self.stats['evictions'] += evicted
+        self.stats['eviction_scans'] += 1
+
+    def get_tile(self, url, coords):
+        key = self._key(url, coords)
+        with self._lock:
+            if not self._migrated:
+                self.migrate_flat_files()
+            tile = self._memory.get(key)
+            if tile is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return tile
+        # reading and fetching are done outside the lock, to allow concurrent fetches
+        path = self._path(key)
+        tile = self._read(path)
+        if tile is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._key_lock(path):
+                # the tile may have been fetched by another process while waiting for the lock
+                tile = self._read(path)
+                if tile is None:
+                    tile = self.fetch(url, coords)
+                    self._write(path, tile)
+                    self._add_fetched(path)
+                    with self._lock:
+                        self._remember(key, tile)
+                    return tile
+        with self._lock:
+            self.stats['disk_hits'] += 1
+            self._remember(key, tile)
+        return tile
+
+    def _add_fetched(self, path):
+        with self._lock:
+            self.stats['misses'] += 1
+            if self.max_bytes is None:
+                return
+            if self._disk_size is None:
+                # first miss with a size limit: the scan includes the new file
+                self._disk_size = sum(size for _, size, _ in self._entries())
+            else:
+                self._disk_size += os.path.getsize(path)
+            if self._disk_size > self.max_bytes:
+                self._evict(path)
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+
+class BandCache:
+    """
+    Cache of band files transcoded (e.g. from JPEG2000) to internally tiled, compressed
+    cloud-optimized GeoTIFFs with overviews, in `folder`, for fast windowed reads.
+    Entries are keyed by the source path, and invalidated when its size or mtime change.
+    If `max_bytes` is specified, the least recently used files are evicted whenever the total
+    size of the cached files exceeds it (the file mtime is updated on every hit), down to
+    `low_water * max_bytes`, as in `TileCache`.
+    The folder may be shared by several processes, as in `TileCache`.
+    """
+    creation_options = dict(compress='DEFLATE', predictor='YES', blocksize=512,
+                            overview_resampling='NEAREST', num_threads='ALL_CPUS')
+
+    def __init__(self, folder=os.path.join(cache_dir, 'bands'), max_bytes=None, low_water=0.9):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        # total size of the cached files, computed on the first miss with a `max_bytes`
+        self._disk_size = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _prefix(self, source_path):
+        source_path = os.path.abspath(source_path)
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        return '{}.{}'.format(stem, hashlib.sha1(source_path.encode()).hexdigest()[:16])
+
+    def path(self, source_path):
+        """
+        :return: path of the cache entry of the current version of `source_path`
+        """
+        stat = os.stat(source_path)
+        version = hashlib.sha1('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode()).hexdigest()[:8]
+        return os.path.join(self.folder, '{}.{}.tif'.format(self._prefix(source_path), version))
+
+    def _entries(self):
+        """
+        :return: list of (path, size, mtime) of the cached files
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            # skip temporary files and lock files
+            if entry.name.startswith('.') or not entry.name.endswith('.tif'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _transcode(self, source_path, path):
+        tmp_path = os.path.join(self.folder, '.{}.{}.tif'.format(os.path.basename(path), uuid.uuid4().hex))
+        try:
+            rio.shutil.copy(source_path, tmp_path, driver='COG', **self.creation_options)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_stale(self, source_path, path):
+        prefix = self._prefix(source_path) + '.'
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(prefix) and entry.path != path:
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    if self._disk_size is not None:
+                        self._disk_size -= size
+                    self.stats['invalidations'] += 1
+
+    def _evict(self, keep_path):
+        # rescan, as the folder may be shared with other processes
+        disk_size, evicted = _evict_lru(self._entries(), self.low_water * self.max_bytes, keep_path)
+        with self._lock:
+            self._disk_size = disk_size
+            self.stats['evictions'] += evicted
+            self.stats['eviction_scans'] += 1
+
+    def get(self, source_path):
+        """
+        :return: path of the transcoded `source_path`, transcoding it if not cached
+        """
+        path = self.path(source_path)
+        if os.path.isfile(path):
+            try:
+                os.utime(path)
+                with self._lock:
+                    self.stats['hits'] += 1
+                return path
+            except FileNotFoundError:  # evicted by another process
+                pass
+        with _file_lock(path):
+            # may have been transcoded by another process while waiting for the lock
+            if not os.path.isfile(path):
+                self._transcode(source_path, path)
+                with self._lock:
+                    self.stats['misses'] += 1
+                    if self._disk_size is not None:
+                        self._disk_size += os.path.getsize(path)
+                self._remove_stale(source_path, path)
+                if self.max_bytes is not None:
+                    with self._lock:
+                        if self._disk_size is None:
+                            self._disk_size = sum(size for _, size, _ in self._entries())
+                    if self._disk_size > self.max_bytes:
+                        self._evict(path)
+        return path
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._disk_size = None
+
+
+def warped_hires_tile(url, base_coords, zoomlevel=None, decode=False, resampling=rio.enums.Resampling.cubic):
+    """
+    Same as `hires_tile`, but instead of fetching sub-tiles and merging them, the source is read
+    with a single warped read directly into the web-mercator grid of the result.
+    """
+    if zoomlevel is None:
+        zoomlevel = base_coords[-1]
+    size = 256 * 2 ** (zoomlevel - base_coords[-1])
+    crs = tl.constants.WEB_MERCATOR_CRS
+    bounds = tl.GeoVector.from_xyz(*base_coords).get_bounds(crs)
+    affine = rio.transform.from_bounds(*bounds, width=size, height=size)
+    with rio.open(url) as src:
+        nodata = 0 if src.nodata is None else src.nodata
+        with rio.vrt.WarpedVRT(src, crs=crs, transform=affine, width=size, height=size,
+                               resampling=resampling, src_nodata=nodata, nodata=nodata) as vrt:
+            image = vrt.read(masked=True)
+    unified = tl.GeoRaster2(image=image, affine=affine, crs=crs, nodata=nodata)
+    if decode:
+        unified = asfloat(unified)
+    return unified
+
 
-def hires_tile(url, base_coords, zoomlevel=None, get_tile=uncached_get_tile, decode=False):
+def hires_tile(url, base_coords, zoomlevel=None, get_tile=uncached_get_tile, decode=False, max_workers=None,
+               engine='tiles'):
     """
     Get a tile from url, with footprint computed from `base_coords`, and resolution determined
     by `zoomlevel` (>= `base_coords.z`), possibly higher than 256x256.
     if `decode` specified, uint16 values are converted to floats in [0..1)
+    if `max_workers` specified (> 1), up to `max_workers` sub-tiles are fetched concurrently
+    by a thread pool (`get_tile` must be thread-safe).
+    if `engine` is 'warp', use `warped_hires_tile` (`get_tile` and `max_workers` are ignored).
     """
+    if engine == 'warp':
+        return warped_hires_tile(url, base_coords, zoomlevel, decode=decode)
+    assert engine == 'tiles', 'Unknown engine: {}'.format(engine)
     roi = tl.GeoVector.from_xyz(*base_coords)
     if zoomlevel is None:
         zoomlevel = base_coords[-1]
     num_tiles = 2 ** (zoomlevel - base_coords[-1])
     xcoord, ycoord = (num_tiles * x for x in base_coords[:2])
-    tiles = []
-    for addx, addy in it.product(range(num_tiles), repeat=2):
-        tiles.append(get_tile(url, (xcoord + addx, ycoord + addy, zoomlevel)))
+    sub_coords = [(xcoord + addx, ycoord + addy, zoomlevel)
+                  for addx, addy in it.product(range(num_tiles), repeat=2)]
+    if max_workers is not None and max_workers > 1 and len(sub_coords) > 1:
+        with ThreadPoolExecutor(min(max_workers, len(sub_coords))) as executor:
+            tiles = list(executor.map(get_tile, it.repeat(url), sub_coords))
+    else:
+        tiles = [get_tile(url, coords) for coords in sub_coords]
     unified = tl.georaster.merge_all(tiles, roi=roi)
     if decode:
         unified = asfloat(unified)
@@ -1,8 +1,13 @@
 import os
 import re
+import json
 
-import matplotlib.pyplot as plt
 import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
 from calval.normalized_scene import band_names
 
 # band_names = ['B', 'G', 'R', 'NIR']  # old names (keep comment until fixed)
@@ -10,6 +15,13 @@ band_colors = 'bgrk'
 provider_styles = {'landsat8': 'o-', 'sentinel2': 'd--'}
 
 
+def _utc_timestamp(time):
+    time = pd.Timestamp(time)
+    if time.tzinfo is None:
+        time = time.tz_localize('UTC')
+    return time
+
+
 class SatMeasurements:
     """
     Contains a DataFrame with measurements (mean, median, std) of some product
@@ -17,6 +29,9 @@ class SatMeasurements:
     Stores also the names of the product and the site, and optionally some user defined
     label describing this instance of data.
     Labels are used for plot titles and for default filenames.
+    Can be stored as csv (the default), or as parquet (requires `pyarrow`), which keeps
+    typed columns and the site/product/label in the file metadata, and supports loading
+    selected bands and time ranges.
     """
     fname_fmt = '{site}_{product}.csv'
     fname_fmt_label = fname_fmt[:-4] + '_{label}.csv'
@@ -27,10 +42,21 @@ class SatMeasurements:
         '{', '(?P<').replace('}', '>.*)')
     )
 
+    metadata_key = b'calval'
+
     def __init__(self, df, site, product, label=None):
         self.df = df
         self.site, self.product, self.label = site, product, label
 
+    @classmethod
+    def read(cls, filepath, **kwargs):
+        """
+        Build the SatMeasurements object from a csv or parquet file (by extension).
+        """
+        if filepath.endswith('.parquet'):
+            return cls.from_parquetfile(filepath, **kwargs)
+        return cls.from_csvfile(filepath, **kwargs)
+
     @classmethod
     def from_csvfile(cls, filepath, site=None, product=None, label=None):
         """
@@ -48,27 +74,87 @@ class SatMeasurements:
                 d = m.groupdict()
                 site, product = d['site'], d['product']
                 if label is None:
-                    label = d['label']
+                    label = d.get('label')
         assert None not in {site, product}, "must specify site and product"
         df = pd.read_csv(filepath, parse_dates=[0], index_col=0)
         return cls(df, site, product, label)
 
+    @classmethod
+    def from_parquetfile(cls, filepath, bands=None, columns=None, start=None, end=None,
+                         site=None, product=None, label=None):
+        """
+        Builds the SatMeasurements object from a parquet file (written by `write`).
+        Only the columns of the given `bands` (or the explicit `columns`) are loaded, and
+        only rows with `start` <= timestamp < `end` (naive times are assumed to be UTC).
+        `site`, `product` and `label` are taken from the file metadata, unless specified.
+        """
+        assert pq is not None, 'Missing module: pyarrow'
+        schema = pq.read_schema(filepath)
+        meta = json.loads(schema.metadata[cls.metadata_key].decode('utf-8'))
+        site = meta['site'] if site is None else site
+        product = meta['product'] if product is None else product
+        label = meta['label'] if label is None else label
+        if bands is not None:
+            prefixes = tuple('{}_'.format(band) for band in bands)
+            columns = [name for name in schema.names
+                       if name in {'provider', 'scene_id', 'error'} or name.startswith(prefixes)]
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', _utc_timestamp(start)))
+        if end is not None:
+            filters.append(('timestamp', '<', _utc_timestamp(end)))
+        table = pq.read_table(filepath, columns=columns, filters=filters or None,
+                              use_pandas_metadata=True)
+        return cls(table.to_pandas(), site, product, label)
+
+    def filename(self, ext='.csv'):
+        fmt = self.fname_fmt if self.label is None else self.fname_fmt_label
+        return fmt[:-len('.csv')].format(site=self.site, product=self.product, label=self.label) + ext
+
     @property
     def fname(self):
-        fmt = self.fname_fmt if self.label is None else self.fname_fmt_label
-        return fmt.format(site=self.site, product=self.product, label=self.label)
+        return self.filename()
 
-    def write(self, dir=None, label=None):
+    def write(self, dir=None, label=None, format='csv'):
+        """
+        Write to `dir`, with default filename. `format` is either 'csv' or 'parquet'.
+        :return: path of written file
+        """
         if label is not None:
             self.label = label
-        path = self.fname
+        path = self.filename('.' + format)
         if dir is not None:
             path = os.path.join(dir, path)
-        self.df.to_csv(path)
+        if format == 'csv':
+            self.df.to_csv(path)
+        elif format == 'parquet':
+            self._write_parquet(path)
+        else:
+            raise ValueError('Unknown format: {}'.format(format))
+        return path
+
+    def _write_parquet(self, path):
+        assert pa is not None, 'Missing module: pyarrow'
+        table = pa.Table.from_pandas(self.df)
+        meta = dict(table.schema.metadata or {})
+        meta[self.metadata_key] = json.dumps(
+            {'site': self.site, 'product': self.product, 'label': self.label}).encode('utf-8')
+        pq.write_table(table.replace_schema_metadata(meta), path)
+
+    def merge(self, other):
+        """
+        :return: new SatMeasurements, containing the rows of both `self` and `other`
+           (sorted by timestamp). site, product and label are taken from `self`.
+        """
+        df = pd.concat([self.df, other.df], sort=False)
+        # stable sort: rows of `self` come first for identical timestamps
+        df = df.sort_index(kind='mergesort')
+        return type(self)(df, self.site, self.product, self.label)
 
     def plot(self, band_names=band_names,
              band_colors=band_colors, styles=provider_styles,
              fig=None, legend_label=None):
+        import matplotlib.pyplot as plt
         if fig is None:
             fig = plt.figure()
         for provider in provider_styles.keys():
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
 
 band_colors = {'blue': 'b', 'green': 'g', 'red': 'r', 'nir': 'k'}
@@ -306,6 +305,7 @@ def plot_srfs(srfs, colors=band_colors, styles=satellite_styles, fig=None, title
     :param show: if true - shows the plt.figure
     :return: plt.figure
     """
+    import matplotlib.pyplot as plt
     if fig is None:
         fig = plt.figure()
     if normalize_max:
@@ -1,16 +1,18 @@
+import os
 import logging
-from collections import OrderedDict
+import tempfile
+import datetime as dt
+from collections import OrderedDict, Counter, defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from calval.utils import cached_property, nanquantile
 from calval.raster_utils import uncached_get_tile
+from calval.band_stats import _interpolated_quantile
 from calval.sites import get_site_aoi, site_tile
 from calval.sat_measurements import SatMeasurements
 from calval.normalized_scene import band_names
 from calval.providers import SceneInfo, SceneData
-# Import provider module to enable the factory mechanism
-import calval.providers.sentinel  # noqa: F401
-import calval.providers.landsat  # noqa: F401
 
 
 logger = logging.getLogger(__name__)
@@ -22,10 +24,12 @@ class TilePile:
     Can compute the median tile (a numpy maskedarray, with the median of each pixel)
     and statistics of relative distances from a reference tile.
     """
-    def __init__(self, scenes, band, site_name, base_zoomlevel=13, zoomlevel=None, get_tile=uncached_get_tile):
+    def __init__(self, scenes, band, site_name, base_zoomlevel=13, zoomlevel=None, get_tile=uncached_get_tile,
+                 max_workers=None, engine='tiles'):
         """
         Extract a common tile (bounds determined by coords of the site `site_name`,
         and `base_zoomlevel`, resolution specified by `zoomlevel`)
+        `max_workers` and `engine` are passed to `hires_tile`
         """
         self.band = band
         self.scenes = scenes
@@ -33,13 +37,21 @@ class TilePile:
         if zoomlevel is None:
             zoomlevel = base_zoomlevel
         self.zoomlevel = zoomlevel
-        tiles = [
-            scene.band_tile(band, self.tile_coords, zoomlevel=zoomlevel, get_tile=get_tile)
+        tiles = (
+            scene.band_tile(band, self.tile_coords, zoomlevel=zoomlevel, get_tile=get_tile,
+                            max_workers=max_workers, engine=engine)
             for scene in scenes
-        ]
+        )
+        self.raster = self._stack(tiles)
+
+    def _stack(self, tiles):
+        """
+        :return: raster with the images of all `tiles` as bands
+        """
+        tiles = list(tiles)
         alltiles = np.ma.concatenate([x.image for x in tiles], axis=0)
-        self.raster = tiles[0].copy_with(
-            image=alltiles, band_names=[str(scene.scene_info) for scene in scenes])
+        return tiles[0].copy_with(
+            image=alltiles, band_names=[str(scene.scene_info) for scene in self.scenes])
 
     @cached_property
     def median(self):
@@ -58,60 +70,532 @@ class TilePile:
         diff = (self.raster.image - ref_band) / ref_band
         return nanquantile(diff.filled(np.nan), q)
 
-    # TODO: for small number of rasters (in particular 2 & 3), need self-distance from median.
-    # correct way is to do weighted quantile, giving weight=0.5 for two mid-values if even, and
-    # weight=0 for the mid-value if odd. This requires sorting etc.
     def self_abs_reldiff_quantile(self, q):
         return self.quantile_abs_reldiff(self.median.image, q)
 
     def self_reldiff_quantile(self, q):
         return self.quantile_reldiff(self.median.image, q)
 
+    def reldiff_quantiles(self, ref_band, q, absolute=False, dtype=np.float64):
+        """
+        All quantiles `q` of the relative distance (its absolute value if `absolute`) from `ref_band`,
+        for the whole pile and for each scene. The distances are computed once (as `dtype`, e.g. np.float32
+        to halve the memory) and sorted once.
+        :return: (quantiles of the pile, DataFrame of the quantiles of each scene, a column per quantile)
+        """
+        values, _ = self._reldiff(ref_band, absolute, dtype, weighted=False)
+        return self._quantiles(values, None, q)
 
-def make_sat_measurements(scenes, site_name, product, label=None, bands=band_names, provider=None,
-                          correct_landsat_toa=False):
+    def self_reldiff_quantiles(self, q, absolute=False, dtype=np.float64):
+        """
+        Same as `reldiff_quantiles` from the median, with weighted quantiles, so that the values
+        that determine the median of each pixel do not bias small piles (in particular of 2 or 3 scenes)
+        towards 0: weight 0 for the mid value of an odd number of values, 1/2 for each of the two mid
+        values of an even number.
+        """
+        values, weights = self._reldiff(self.median.image, absolute, dtype, weighted=True)
+        return self._quantiles(values, weights, q)
+
+    def _reldiff_rows(self, rows, ref_band, absolute, dtype, weighted):
+        """
+        :return: (values, weights) of the tile `rows`, as (scenes, pixels) arrays.
+           masked values are nan, `weights` are those of `_median_weights` (None if not `weighted`).
+        """
+        image = self.raster.image[:, rows].astype(dtype)
+        ref = np.ma.asanyarray(ref_band)[..., rows, :].astype(dtype)
+        diff = np.ma.abs(image - ref) / ref if absolute else (image - ref) / ref
+        values = diff.filled(np.nan).reshape(len(image), -1)
+        weights = _median_weights(image).reshape(values.shape) if weighted else None
+        return values, weights
+
+    def _reldiff(self, ref_band, absolute, dtype, weighted):
+        return self._reldiff_rows(slice(None), ref_band, absolute, dtype, weighted)
+
+    def _quantiles(self, values, weights, q):
+        """
+        sort each scene's `values` (in place), and compute the quantiles of each scene and of the pile
+        """
+        scene_quantiles = []
+        for i in range(len(values)):
+            if weights is None:
+                values[i].sort()
+            else:
+                order = np.argsort(values[i])
+                values[i] = values[i][order]
+                weights[i] = weights[i][order]
+            scene_quantiles.append(_sorted_quantile(values[i], q, None if weights is None else weights[i]))
+        scene_quantiles = pd.DataFrame(np.reshape(scene_quantiles, (len(values), -1)),
+                                       index=self.raster.band_names, columns=np.atleast_1d(q))
+        return self._pile_quantile(values, weights, q), scene_quantiles
+
+    def _pile_quantile(self, values, weights, q):
+        """
+        quantile of all (sorted per scene) `values`
+        """
+        # stable sort (timsort) of sorted runs is a merge
+        if weights is None:
+            return _sorted_quantile(np.sort(values, axis=None, kind='stable'), q)
+        order = np.argsort(values, axis=None, kind='stable')
+        return _sorted_quantile(values.ravel()[order], q, weights.ravel()[order])
+
+
+def _chunked_nanquantile(chunks, q, max_items):
     """
-    Given a list of `scenes` (either filenames or SceneInfo objects), filter ther
-    ones that match the given `site_name` and `product`, and build SatMeasurements object
-    containing the measurement values for the specied `bands`.
-    A `label` may be added to tag the resulting SatMeasurements object.
-    In `provider` is specifed, we filter only products of that provider.
+    Same as `nanquantile(values, q)` (linear interpolation), where `values` are the concatenation
+    of the arrays yielded by `chunks()`. Each needed order statistic is found exactly, by repeatedly
+    narrowing its range (counting the values between pivots sampled from the candidates), until its
+    candidates fit in `max_items`. Each round takes two passes over the chunks.
+    """
+    count = sum(np.count_nonzero(~np.isnan(values)) for values in chunks())
+
+    def _take(indexes):
+        stats = _order_statistics(chunks, set(indexes.ravel()), count, max_items)
+        return np.vectorize(stats.get, otypes=[np.float64])(indexes)
+    return _interpolated_quantile(_take, count, q)
+
+
+def _sorted_quantile(values, q, weights=None):
+    """
+    quantile `q` of the non-nan `values`, which are sorted (with nans last).
+    Integer `weights`, if given, count each value as repeated by its weight.
+    """
+    if weights is None:
+        return _interpolated_quantile(lambda indexes: values[indexes], np.count_nonzero(~np.isnan(values)), q)
+    cumulative = np.cumsum(np.where(np.isnan(values), 0, weights), dtype=np.int64)
+    count = int(cumulative[-1]) if len(cumulative) else 0
+    return _interpolated_quantile(lambda indexes: values[np.searchsorted(cumulative, indexes, 'right')], count, q)
+
+
+def _median_weights(image):
+    """
+    Weights of the values of each pixel of `image` (a masked stack of scenes), for the quantiles of
+    distances from the median: 0 for the mid value of an odd number of values, 1/2 for each of the
+    two mid values of an even number, 1 otherwise. They are doubled, to be integers.
+    """
+    filled = image.filled(np.nan)
+    order = np.argsort(filled, axis=0)
+    ranks = np.empty(filled.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.broadcast_to(
+        np.arange(len(filled)).reshape((-1,) + (1,) * (filled.ndim - 1)), filled.shape), axis=0)
+    counts = np.count_nonzero(~np.isnan(filled), axis=0)
+    odd = counts % 2 == 1
+    weights = np.full(filled.shape, 2, dtype=np.int8)
+    weights[(ranks == counts // 2) & odd] = 0
+    weights[((ranks == counts // 2) | (ranks == counts // 2 - 1)) & ~odd] = 1
+    return weights
+
+
+def _order_statistics(chunks, ks, count, max_items, max_pivots=4096):
+    """
+    :return: dict of the `k`-th smallest (non-nan) value of `chunks()` for each `k` in `ks`
+       (`count` is the number of non-nan values)
+    """
+    # the candidates of each order statistic are the values in the open range (lo, hi)
+    # (None for unbounded), `below` is the number of values <= lo.
+    pending = [dict(k=k, lo=None, hi=None, below=0, count=count) for k in sorted(ks)]
+    results = {}
+
+    def _candidates(values, state):
+        values = values[~np.isnan(values)]
+        if state['lo'] is not None:
+            values = values[values > state['lo']]
+        if state['hi'] is not None:
+            values = values[values < state['hi']]
+        return values
+
+    while pending:
+        gather = [state for state in pending if state['count'] <= max_items // len(pending)]
+        narrow = [state for state in pending if state['count'] > max_items // len(pending)]
+        n_pivots = max(1, min(max_pivots, max_items // (4 * max(1, len(narrow)))))
+        gathered = [[] for _ in gather]
+        samples = [[] for _ in narrow]
+        offsets = [0] * len(narrow)
+        for values in chunks():
+            for state, found in zip(gather, gathered):
+                found.append(_candidates(values, state))
+            for i, state in enumerate(narrow):
+                candidates = _candidates(values, state)
+                stride = -(-state['count'] // n_pivots)
+                samples[i].append(candidates[(-offsets[i]) % stride::stride])
+                offsets[i] += len(candidates)
+        for state, found in zip(gather, gathered):
+            found = np.concatenate(found)
+            rank = state['k'] - state['below']
+            results[state['k']] = np.partition(found, rank)[rank]
+        pivots = [np.unique(np.concatenate(sample)) for sample in samples]
+        # bins: 2*i+1 holds values equal to pivots[i], 2*i the values between pivots[i-1] and pivots[i]
+        counts = [np.zeros(2 * len(p) + 1, dtype=np.int64) for p in pivots]
+        for values in chunks():
+            for state, p, bin_counts in zip(narrow, pivots, counts):
+                candidates = _candidates(values, state)
+                bins = np.searchsorted(p, candidates, 'left') + np.searchsorted(p, candidates, 'right')
+                bin_counts += np.bincount(bins, minlength=len(bin_counts))
+        pending = []
+        for state, p, bin_counts in zip(narrow, pivots, counts):
+            rank = state['k'] - state['below']
+            cumulative = np.cumsum(bin_counts)
+            j = int(np.searchsorted(cumulative, rank, 'right'))
+            if j % 2:
+                results[state['k']] = p[j // 2]
+                continue
+            i = j // 2
+            state['below'] += int(cumulative[j] - bin_counts[j])
+            state['count'] = int(bin_counts[j])
+            if i > 0:
+                state['lo'] = p[i - 1]
+            if i < len(p):
+                state['hi'] = p[i]
+            pending.append(state)
+    return results
+
+
+class DiskTilePile(TilePile):
+    """
+    TilePile for large stacks of scenes: the stack of tiles is kept in memory-mapped files
+    (in a temporary folder under `dir`, removed with the pile), and the median and reldiff quantiles
+    are computed in spatial chunks (of tile rows) using up to about `memory_bytes`.
+    The results are the same as those of TilePile.
+    """
+    def __init__(self, scenes, band, site_name, base_zoomlevel=13, zoomlevel=None, get_tile=uncached_get_tile,
+                 max_workers=None, engine='tiles', memory_bytes=256 << 20, dir=None):
+        self.memory_bytes = memory_bytes
+        self._tempdir = tempfile.TemporaryDirectory(prefix='tilepile_', dir=dir)
+        super().__init__(scenes, band, site_name, base_zoomlevel=base_zoomlevel, zoomlevel=zoomlevel,
+                         get_tile=get_tile, max_workers=max_workers, engine=engine)
+
+    def _stack(self, tiles):
+        first = data = mask = None
+        for i, tile in enumerate(tiles):
+            if first is None:
+                first = tile
+                shape = (len(self.scenes),) + tile.image.shape[1:]
+                data = np.memmap(os.path.join(self._tempdir.name, 'data'), dtype=tile.image.dtype,
+                                 mode='w+', shape=shape)
+                mask = np.memmap(os.path.join(self._tempdir.name, 'mask'), dtype=bool, mode='w+', shape=shape)
+            data[i] = tile.image.data[0]
+            mask[i] = np.ma.getmaskarray(tile.image)[0]
+        return first.copy_with(image=np.ma.masked_array(data, mask=mask, copy=False),
+                               band_names=[str(scene.scene_info) for scene in self.scenes])
+
+    def close(self):
+        """
+        remove the files of the stack (also done when the pile is garbage-collected)
+        """
+        self.__dict__.pop('raster', None)
+        self._tempdir.cleanup()
+
+    def _row_chunks(self):
+        """
+        :return: slices of the tile rows, each small enough for the memory budget
+           (the stack, mask and a few float temporaries of its rows)
+        """
+        n, height, width = self.raster.image.shape
+        rows = max(1, self.memory_bytes // (4 * n * width * (self.raster.image.itemsize + 1)))
+        return [slice(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+    @cached_property
+    def median(self):
+        image = self.raster.image
+        median = np.ma.concatenate([np.ma.median(image[:, rows], axis=0) for rows in self._row_chunks()])
+        return self.raster.copy_with(image=median, band_names=[self.band])
+
+    def _quantile(self, ref_band, q, diff_func):
+        ref_band = np.ma.asanyarray(ref_band)
+
+        def _chunks():
+            for rows in self._row_chunks():
+                ref_rows = ref_band[..., rows, :]
+                yield diff_func(self.raster.image[:, rows], ref_rows).filled(np.nan).ravel()
+        return _chunked_nanquantile(_chunks, q, max(1, self.memory_bytes // 16))
+
+    def quantile_abs_reldiff(self, ref_band, q):
+        return self._quantile(ref_band, q, lambda image, ref: np.ma.abs(image - ref) / ref)
+
+    def quantile_reldiff(self, ref_band, q):
+        return self._quantile(ref_band, q, lambda image, ref: (image - ref) / ref)
+
+    def _reldiff(self, ref_band, absolute, dtype, weighted):
+        # memory-mapped (scenes, pixels) arrays, filled by chunks
+        n, height, width = self.raster.image.shape
+        path = os.path.join(self._tempdir.name, 'reldiff')
+        values = np.memmap(path, dtype=dtype, mode='w+', shape=(n, height * width))
+        weights = np.memmap(path + '_weights', dtype=np.int8, mode='w+', shape=values.shape) if weighted else None
+        for rows in self._row_chunks():
+            pixels = slice(rows.start * width, rows.stop * width)
+            values[:, pixels], chunk_weights = self._reldiff_rows(rows, ref_band, absolute, dtype, weighted)
+            if weighted:
+                weights[:, pixels] = chunk_weights
+        return values, weights
+
+    def _pile_quantile(self, values, weights, q):
+        scenes_per_chunk = max(1, self.memory_bytes // (4 * values.shape[1] * (values.itemsize + 1)))
+
+        def _chunks():
+            for start in range(0, len(values), scenes_per_chunk):
+                chunk = np.asarray(values[start:start + scenes_per_chunk]).ravel()
+                if weights is not None:
+                    chunk = np.repeat(chunk, weights[start:start + scenes_per_chunk].ravel())
+                yield chunk
+        return _chunked_nanquantile(_chunks, q, max(1, self.memory_bytes // 16))
+
+
+def _extracted_product(sceneinfo, product, correct_landsat_toa):
+    """the product actually extracted from the scene"""
+    if (not correct_landsat_toa) and sceneinfo.provider == 'landsat8' and product == 'toa':
+        return 'toa_raw'
+    return product
+
+
+def _extract_scene_rows(sceneinfo, site_aois, product, bands, correct_landsat_toa):
+    """
+    Build the measurements rows of a single scene (extracting its archive if needed),
+    one row per site in the `site_aois` dict. Band files are opened once for all sites.
+    This is a module level function, so that it can be submitted to process pools.
+    """
+    if product.startswith('computed_toa'):
+        compute_correction = product.endswith('_corrected')
+    else:
+        compute_correction = None
+    logger.debug('archive: %s exists?: %s', sceneinfo.archive_path(), sceneinfo.is_archive())
+    if sceneinfo.is_archive() or not sceneinfo.is_scene():
+        # only the metadata and the needed bands are extracted (if missing)
+        logger.info('archive: %s: extracting %s from archive', sceneinfo.archive_path(), bands)
+        sceneinfo.extract_archive(bands)
+    # reading the metadata provides better timestamp than the sceneinfo one,
+    # and also makes available the proper scaling factors (execute by default?)
+    scenedata = SceneData.from_sceneinfo(sceneinfo)
+    aois = list(site_aois.values())
+    logger.debug('extracting %s for bands %s, sites %s', product, bands, list(site_aois))
+    if product.startswith('computed_toa'):
+        values = scenedata.extract_multi_computed_toa(aois, bands, compute_correction)
+    else:
+        values = scenedata.extract_multi_values(
+            aois, bands, product=_extracted_product(sceneinfo, product, correct_landsat_toa))
+    rows = OrderedDict()
+    for site_name, site_values in zip(site_aois, values):
+        row = OrderedDict(timestamp=scenedata.timestamp, provider=sceneinfo.provider, scene_id=sceneinfo.scene_id)
+        row.update(site_values)
+        rows[site_name] = row
+    return rows
+
+
+def _error_row(sceneinfo, error):
+    """
+    Row reporting a failed scene. The sceneinfo timestamp is less accurate than the
+    metadata one, but is all we have (make it UTC aware, like the metadata timestamps).
+    """
+    return OrderedDict(timestamp=sceneinfo.timestamp.replace(tzinfo=dt.timezone.utc),
+                       provider=sceneinfo.provider, scene_id=sceneinfo.scene_id, error=repr(error))
+
+
+_executor_types = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+
+
+def _get_executor(executor, max_workers):
+    """
+    :return: (executor, owned). `owned` is True if the executor was created here
+       (and should be shut down by the caller).
+    """
+    if isinstance(executor, Executor):
+        return executor, False
+    if executor not in _executor_types:
+        raise ValueError('Unknown executor type: {}'.format(executor))
+    return _executor_types[executor](max_workers=max_workers), True
+
+
+def _parallel_scene_rows(tasks, executor, max_workers, *args):
+    """
+    `tasks` is a list of (sceneinfo, site_aois) pairs.
+    :return: list of per-scene rows dicts (see `_extract_scene_rows`), in the order of `tasks`.
+    """
+    executor, owned = _get_executor(executor, max_workers)
+    try:
+        futures = [executor.submit(_extract_scene_rows, sceneinfo, site_aois, *args)
+                   for sceneinfo, site_aois in tasks]
+        scene_rows = []
+        # collect in submission order, so that the result does not depend on scheduling
+        for (sceneinfo, site_aois), future in zip(tasks, futures):
+            try:
+                scene_rows.append(future.result())
+            except Exception as e:
+                logger.exception('failed extracting scene %s', sceneinfo.scene_id)
+                scene_rows.append(OrderedDict(
+                    (site_name, _error_row(sceneinfo, e)) for site_name in site_aois))
+    finally:
+        if owned:
+            executor.shutdown()
+    return scene_rows
+
+
+def _cached_rows(stats_cache, tasks, product, bands, correct_landsat_toa):
+    """
+    Look up the rows of `tasks` in the `stats_cache`.
+    :return: (scene_rows, missing_inds, missing_tasks), where scene_rows contains the cached
+       rows per task, and missing_tasks are the (sceneinfo, site_aois) pairs still to be extracted.
+    """
+    scene_rows = [OrderedDict() for _ in tasks]
+    missing_inds, missing_tasks = [], []
+    for i, (sceneinfo, site_aois) in enumerate(tasks):
+        cache_product = _extracted_product(sceneinfo, product, correct_landsat_toa)
+        missing = OrderedDict()
+        for site_name, aoi in site_aois.items():
+            cached = None
+            if stats_cache is not None:
+                cached = stats_cache.get(sceneinfo.scene_id, site_name, cache_product, aoi, bands)
+            if cached is None:
+                missing[site_name] = aoi
+            else:
+                row = OrderedDict(timestamp=cached.pop('timestamp'), provider=sceneinfo.provider,
+                                  scene_id=sceneinfo.scene_id)
+                row.update(cached)
+                scene_rows[i][site_name] = row
+        if missing:
+            missing_inds.append(i)
+            missing_tasks.append((sceneinfo, missing))
+    return scene_rows, missing_inds, missing_tasks
+
+
+def _cache_rows(stats_cache, tasks, tasks_rows, product, bands, correct_landsat_toa):
+    for (sceneinfo, site_aois), rows in zip(tasks, tasks_rows):
+        cache_product = _extracted_product(sceneinfo, product, correct_landsat_toa)
+        for site_name, row in rows.items():
+            if 'error' not in row:
+                stats_cache.put(sceneinfo.scene_id, site_name, cache_product, site_aois[site_name], bands, row)
+
+
+def _rows_dataframe(rows):
+    if not rows:
+        return pd.DataFrame(columns=['provider', 'scene_id'], index=pd.DatetimeIndex([], name='timestamp'))
+    df = pd.DataFrame(rows)
+    # stable sort keeps the input order of scenes with identical timestamps
+    return df.set_index('timestamp').sort_index(kind='mergesort')
+
+
+def make_multisite_sat_measurements(scenes, site_names, product, label=None, bands=band_names,
+                                    provider=None, correct_landsat_toa=False, executor=None,
+                                    max_workers=None, stats_cache=None):
+    """
+    Same as `make_sat_measurements`, for several sites at once: each scene is read once,
+    and its band rasters are cropped to all the sites it contains.
+    If a `stats_cache` (`calval.stats_cache.StatsCache`) is specified, values are taken from
+    it when available, and only the missing scenes/sites are extracted (and then cached).
+    :return: OrderedDict of SatMeasurements objects, keyed by the `site_names`.
     """
     if len(scenes) and isinstance(scenes[0], str):
         scenes = (SceneInfo.from_filename(scene) for scene in scenes)
 
-    aoi = get_site_aoi(site_name)
+    all_aois = OrderedDict((site_name, get_site_aoi(site_name)) for site_name in site_names)
     if product.startswith('computed_toa'):
         req_product = 'irradiance'
-        compute_correction = product.endswith('_corrected')
     else:
         req_product = product
-        compute_correction = None
-    rows = []
+    tasks = []
     for sceneinfo in scenes:
-        if not sceneinfo.contains_site(site_name):
-            continue
         if req_product not in sceneinfo.products:
             continue
         if provider is not None and sceneinfo.provider != provider:
             continue
-        logger.debug('archive: %s exists?: %s', sceneinfo.archive_path(), sceneinfo.is_archive())
-        if not sceneinfo.is_scene():
-            logger.info('archive: %s: extracting scene from archive', sceneinfo.archive_path())
-            sceneinfo.extract_archive()
-        # reading the metadata provides better timestamp than the sceneinfo one,
-        # and also makes available the proper scaling factors (execute by default?)
-        scenedata = SceneData.from_sceneinfo(sceneinfo)
-        row = OrderedDict(timestamp=scenedata.timestamp, provider=sceneinfo.provider)
-        logger.debug('extracting %s for bands %s', product, bands)
-        if product.startswith('computed_toa'):
-            row.update(scenedata.extract_computed_toa(aoi, bands, compute_correction))
-        else:
-            if ((not correct_landsat_toa) and sceneinfo.provider == 'landsat8' and product == 'toa'):
-                row.update(scenedata.extract_values(aoi, bands, product='toa_raw'))
-            else:
-                row.update(scenedata.extract_values(aoi, bands, product=product))
-        rows.append(row)
-    df = pd.DataFrame(rows)
-    df = df.set_index('timestamp').sort_index()
-    return SatMeasurements(df, site_name, product, label)
+        site_aois = OrderedDict((site_name, aoi) for site_name, aoi in all_aois.items()
+                                if sceneinfo.contains_site(site_name))
+        if site_aois:
+            tasks.append((sceneinfo, site_aois))
+
+    args = (product, bands, correct_landsat_toa)
+    scene_rows, missing_inds, missing_tasks = _cached_rows(stats_cache, tasks, *args)
+    if executor is None and max_workers is not None:
+        executor = 'process'
+    if executor is None:
+        new_rows = [_extract_scene_rows(sceneinfo, site_aois, *args) for sceneinfo, site_aois in missing_tasks]
+    else:
+        new_rows = _parallel_scene_rows(missing_tasks, executor, max_workers, *args)
+    if stats_cache is not None:
+        _cache_rows(stats_cache, missing_tasks, new_rows, *args)
+    for i, rows in zip(missing_inds, new_rows):
+        scene_rows[i].update(rows)
+
+    results = OrderedDict()
+    for site_name in site_names:
+        rows = [rows[site_name] for rows in scene_rows if site_name in rows]
+        results[site_name] = SatMeasurements(_rows_dataframe(rows), site_name, product, label)
+    return results
+
+
+def make_sat_measurements(scenes, site_name, product, label=None, bands=band_names, provider=None,
+                          correct_landsat_toa=False, executor=None, max_workers=None, stats_cache=None):
+    """
+    Given a list of `scenes` (either filenames or SceneInfo objects), filter ther
+    ones that match the given `site_name` and `product`, and build SatMeasurements object
+    containing the measurement values for the specied `bands`.
+    A `label` may be added to tag the resulting SatMeasurements object.
+    In `provider` is specifed, we filter only products of that provider.
+
+    Scenes are processed in parallel if `executor` is specified: either 'process', 'thread'
+    or a `concurrent.futures.Executor` instance. If only `max_workers` is specified, a process
+    pool is used. In parallel mode, failing scenes do not abort the run: they are reported
+    as rows with an `error` column (and NaN values).
+
+    If a `stats_cache` (`calval.stats_cache.StatsCache`) is specified, raster values are only
+    extracted for scenes which are missing from the cache.
+    """
+    return make_multisite_sat_measurements(
+        scenes, [site_name], product, label=label, bands=bands, provider=provider,
+        correct_landsat_toa=correct_landsat_toa, executor=executor, max_workers=max_workers,
+        stats_cache=stats_cache)[site_name]
+
+
+def _legacy_scene_key(provider, timestamp):
+    """key of rows written without a scene_id column (which do not identify the tile)"""
+    return provider, timestamp.date()
+
+
+def update_sat_measurements(sat_measurements, scenes, bands=band_names, provider=None,
+                            correct_landsat_toa=False, executor=None, max_workers=None,
+                            stats_cache=None):
+    """
+    Incrementally update `sat_measurements` (either a SatMeasurements object, or a csv/parquet
+    file path for `SatMeasurements.read`) with values from those of the `scenes` which
+    it does not contain yet. Scenes are identified by the `scene_id` column of the rows.
+    Rows of older files, without a scene_id, are matched by provider and acquisition date: if there
+    are less such rows than scenes of the site with that provider and date (e.g. several tiles),
+    these rows are dropped and all these scenes are extracted again.
+    Rows of scenes that previously failed (error rows) are dropped and extracted again.
+    Other arguments are as in `make_sat_measurements`.
+    :return: new SatMeasurements object, with rows sorted by timestamp.
+    """
+    if isinstance(sat_measurements, str):
+        sat_measurements = SatMeasurements.read(sat_measurements)
+    df = sat_measurements.df
+    if 'error' in df.columns:
+        df = df[df['error'].isnull()].drop('error', axis=1)
+    scene_ids = df['scene_id'] if 'scene_id' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    existing = set(scene_ids.dropna())
+    legacy_keys = [_legacy_scene_key(row_provider, timestamp) if pd.isnull(scene_id) else None
+                   for timestamp, row_provider, scene_id in zip(df.index, df['provider'], scene_ids)]
+    legacy_counts = Counter(key for key in legacy_keys if key is not None)
+
+    if len(scenes) and isinstance(scenes[0], str):
+        scenes = [SceneInfo.from_filename(scene) for scene in scenes]
+    candidates = defaultdict(list)
+    for sceneinfo in scenes:
+        if sceneinfo.scene_id not in existing and sceneinfo.contains_site(sat_measurements.site):
+            candidates[_legacy_scene_key(sceneinfo.provider, sceneinfo.timestamp)].append(sceneinfo)
+    new_scenes = []
+    redo_keys = set()
+    for key, key_scenes in candidates.items():
+        if legacy_counts[key] >= len(key_scenes):
+            continue
+        new_scenes.extend(key_scenes)
+        if legacy_counts[key]:
+            redo_keys.add(key)
+    if redo_keys:
+        df = df[[key not in redo_keys for key in legacy_keys]]
+    logger.info('updating %s %s: %d new scenes', sat_measurements.site, sat_measurements.product,
+                len(new_scenes))
+    old = SatMeasurements(df, sat_measurements.site, sat_measurements.product, sat_measurements.label)
+    if not new_scenes:
+        return old
+    new = make_sat_measurements(
+        new_scenes, old.site, old.product, bands=bands, provider=provider,
+        correct_landsat_toa=correct_landsat_toa, executor=executor, max_workers=max_workers,
+        stats_cache=stats_cache)
+    return old.merge(new)
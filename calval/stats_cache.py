@@ -0,0 +1,97 @@
+"""
+Persistent cache of per-scene site statistics, as extracted by `SceneData.extract_values`.
+Entries are kept in an sqlite file, keyed by scene, site, product, band, the hash of the
+site aoi and the version of the statistics code.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+import dateutil.parser
+import numpy as np
+import telluric as tl
+from calval.config import cache_dir
+
+# Bump this whenever the computation of the statistics changes, to invalidate old entries
+STATS_VERSION = '2'
+
+_key_fields = ['scene_id', 'site', 'product', 'band', 'aoi_hash', 'version']
+
+
+def aoi_hash(aoi):
+    shape = aoi.get_shape(tl.constants.WGS84_CRS)
+    return hashlib.sha1(shape.wkb).hexdigest()
+
+
+def _split_row(row, bands):
+    """
+    split a row of '{band}_{stat}' values to a dict of {stat: value} per band
+    """
+    band_stats = OrderedDict((band, OrderedDict()) for band in bands)
+    for band in bands:
+        prefix = band + '_'
+        for key, value in row.items():
+            if key.startswith(prefix):
+                band_stats[band][key[len(prefix):]] = float(np.ma.filled(value, np.nan))
+    return band_stats
+
+
+class StatsCache:
+    def __init__(self, path=os.path.join(cache_dir, 'stats.sqlite'), version=STATS_VERSION):
+        self.path = path
+        self.version = version
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS stats ({}, timestamp TEXT, stats TEXT, PRIMARY KEY ({}))'.format(
+                    ', '.join('{} TEXT'.format(fld) for fld in _key_fields), ', '.join(_key_fields)))
+
+    @contextmanager
+    def _connect(self):
+        # a new connection per operation, so that the cache can be shared by processes
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, scene_id, site, product, aoi, bands):
+        """
+        :return: the cached row (timestamp and values of all `bands`), or None if
+           any of the bands is missing.
+        """
+        query = 'SELECT band, timestamp, stats FROM stats WHERE {}'.format(
+            ' AND '.join('{}=?'.format(fld) for fld in _key_fields if fld != 'band'))
+        with self._connect() as conn:
+            found = {band: (timestamp, stats) for band, timestamp, stats in conn.execute(
+                query, (scene_id, site, product, aoi_hash(aoi), self.version))}
+        if not all(band in found for band in bands):
+            return None
+        row = OrderedDict(timestamp=dateutil.parser.parse(found[bands[0]][0]))
+        for band in bands:
+            for stat, value in json.loads(found[band][1], object_pairs_hook=OrderedDict).items():
+                row['{}_{}'.format(band, stat)] = value
+        return row
+
+    def put(self, scene_id, site, product, aoi, bands, row):
+        """
+        store the values of `row` (as built by `make_sat_measurements`) for all `bands`
+        """
+        key = (scene_id, site, product, None, aoi_hash(aoi), self.version)
+        timestamp = row['timestamp'].isoformat()
+        entries = [
+            key[:3] + (band,) + key[4:] + (timestamp, json.dumps(stats))
+            for band, stats in _split_row(row, bands).items()
+        ]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO stats VALUES ({})'.format(
+                ', '.join('?' * (len(_key_fields) + 2))), entries)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stats')
@@ -3,10 +3,19 @@ Abstraction of queryable storage for NormalizedScenes
 """
 import os
 import glob
+import json
+import sqlite3
+import datetime as dt
 import itertools as it
+from contextlib import contextmanager
+import dateutil.parser
 import calval.config
 from calval.normalized_scene import FilebasedScene, NormalizedSceneId
 
+catalog_filename = 'catalog.sqlite'
+# query arguments which are only supported by the catalog
+catalog_filters = {'start', 'end', 'min_cloud_cover', 'max_cloud_cover', 'bbox'}
+
 
 def glob_patterns(separator=os.path.sep, **kwargs):
     """
@@ -34,11 +43,193 @@ def glob_patterns(separator=os.path.sep, **kwargs):
     return patterns
 
 
+def utc_isoformat(time):
+    """
+    :param time: datetime or str (naive times are assumed to be UTC)
+    :return: str which can be compared lexicographically
+    """
+    if isinstance(time, str):
+        time = dateutil.parser.parse(time)
+    if time.tzinfo is not None:
+        time = time.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return time.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def footprint_bbox(footprint):
+    """
+    :param footprint: GeoJSON polygon (dict), in lon/lat
+    :return: (min_lon, min_lat, max_lon, max_lat)
+    """
+    lons, lats = zip(*footprint['coordinates'][0])
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+class SceneCatalog:
+    """
+    Index of the metadata files of a FileStorage, kept in an sqlite file in its `base_dir`.
+    The index is updated incrementally (by the mtime of metadata files), and supports
+    range queries on timestamp, cloud cover and footprint bbox.
+    """
+    _fields = list(NormalizedSceneId.tuple_type._fields)
+    _columns = ['path', 'mtime_ns'] + ['id_' + fld for fld in _fields] + [
+        'timestamp', 'cloud_cover', 'min_lon', 'min_lat', 'max_lon', 'max_lat', 'metadata']
+
+    def __init__(self, base_dir, path=None):
+        self.base_dir = base_dir
+        self.path = path or os.path.join(base_dir, catalog_filename)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS scenes ({}, PRIMARY KEY (path))'.format(
+                ', '.join(self._columns)))
+            conn.execute('CREATE INDEX IF NOT EXISTS scenes_timestamp ON scenes (timestamp)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _row(self, relpath, mtime_ns):
+        with open(os.path.join(self.base_dir, relpath)) as f:
+            metadata_str = f.read()
+        metadata = json.loads(metadata_str)
+        scene_id = NormalizedSceneId.from_str(metadata['scene_id']).str_tuple
+        bbox = footprint_bbox(metadata['footprint']) if 'footprint' in metadata else (None,) * 4
+        return (relpath, mtime_ns) + tuple(scene_id) + (
+            utc_isoformat(metadata['timestamp']), metadata.get('metadata', {}).get('cloud_cover')) + \
+            tuple(bbox) + (metadata_str,)
+
+    def update(self):
+        """
+        Index new and modified metadata files, and remove deleted ones.
+        :return: number of (re)indexed files
+        """
+        pattern = os.path.join(self.base_dir, glob_patterns()[0], '*_metadata.json')
+        found = {}
+        for path in glob.glob(pattern):
+            try:
+                found[os.path.relpath(path, self.base_dir)] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        with self._connect() as conn:
+            indexed = dict(conn.execute('SELECT path, mtime_ns FROM scenes'))
+            conn.executemany('DELETE FROM scenes WHERE path=?',
+                             [(path,) for path in indexed if path not in found])
+            rows = [self._row(path, mtime_ns) for path, mtime_ns in found.items()
+                    if indexed.get(path) != mtime_ns]
+            self._insert(conn, rows)
+        return len(rows)
+
+    def _insert(self, conn, rows):
+        conn.executemany('INSERT OR REPLACE INTO scenes VALUES ({})'.format(
+            ', '.join('?' * len(self._columns))), rows)
+
+    def add(self, paths):
+        """
+        Index (or re-index) the metadata files `paths` (e.g. of newly saved scenes),
+        without scanning the whole folder.
+        """
+        rows = [self._row(os.path.relpath(path, self.base_dir), os.stat(path).st_mtime_ns) for path in paths]
+        with self._connect() as conn:
+            self._insert(conn, rows)
+
+    def query(self, start=None, end=None, min_cloud_cover=None, max_cloud_cover=None, bbox=None, **kwargs):
+        """
+        Query the catalog. keyword args of NormalizedSceneId fields are as in `glob_patterns`,
+        and the results can be further restricted to `start` <= timestamp < `end`,
+        `min_cloud_cover` <= cloud_cover <= `max_cloud_cover`, and footprints intersecting
+        `bbox` (min_lon, min_lat, max_lon, max_lat).
+        :return: list of FilebasedScene, sorted by path
+        """
+        conditions, params = [], []
+        for field in self._fields:
+            values = kwargs.pop(field, None)
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            conditions.append('({})'.format(' OR '.join(['id_{} GLOB ?'.format(field)] * len(values)) or '0'))
+            params.extend(values)
+        assert not kwargs, 'Unrecognized field names: {}'.format(kwargs)
+        for column, op, value in [('timestamp', '>=', start), ('timestamp', '<', end),
+                                  ('cloud_cover', '>=', min_cloud_cover), ('cloud_cover', '<=', max_cloud_cover)]:
+            if value is not None:
+                conditions.append('{} {} ?'.format(column, op))
+                params.append(utc_isoformat(value) if column == 'timestamp' else value)
+        if bbox is not None:
+            conditions.append('max_lon >= ? AND max_lat >= ? AND min_lon <= ? AND min_lat <= ?')
+            params.extend(bbox)
+        query = 'SELECT path, metadata FROM scenes'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        with self._connect() as conn:
+            rows = list(conn.execute(query + ' ORDER BY path', params))
+        scenes = []
+        for path, metadata in rows:
+            scene = FilebasedScene(os.path.join(self.base_dir, path))
+            scene.metadata = json.loads(metadata)
+            scenes.append(scene)
+        return scenes
+
+
 class FileStorage:
+    """
+    Storage of normalized scenes in a local folder.
+    If the folder contains a catalog (see `SceneCatalog`, `build_catalog`), it is used for queries.
+    The catalog is not updated by queries (unless requested): scenes saved by
+    `SceneData.save_normalized` are added to it (see `add_scenes`), otherwise call
+    `update_catalog` after adding or removing scenes.
+    """
     def __init__(self, base_dir=calval.config.normalized_dir):
         self.base_dir = base_dir
 
-    def query(self, **kwargs):
+    @property
+    def catalog(self):
+        if os.path.isfile(os.path.join(self.base_dir, catalog_filename)):
+            return SceneCatalog(self.base_dir)
+        return None
+
+    def build_catalog(self):
+        """
+        Create (or update) the catalog file of the folder.
+        """
+        catalog = SceneCatalog(self.base_dir)
+        catalog.update()
+        return catalog
+
+    def update_catalog(self):
+        """
+        Update the catalog (if there is one) with the added, modified and removed scenes.
+        :return: number of (re)indexed files
+        """
+        catalog = self.catalog
+        return 0 if catalog is None else catalog.update()
+
+    def add_scenes(self, metadata_paths):
+        """
+        Add the scenes of `metadata_paths` to the catalog, if there is one
+        """
+        catalog = self.catalog
+        if catalog is not None:
+            catalog.add(metadata_paths)
+
+    def query(self, refresh=False, **kwargs):
+        """
+        :param refresh: update the catalog (if there is one) before querying it
+        :param kwargs: NormalizedSceneId fields, as in `glob_patterns`. If there is a catalog,
+           range filters of `SceneCatalog.query` are also supported (a catalog must be created
+           explicitly by `build_catalog` for them).
+        """
+        catalog = self.catalog
+        if catalog is None and catalog_filters.intersection(kwargs):
+            raise ValueError('Filters {} require a catalog, see FileStorage.build_catalog'.format(
+                sorted(catalog_filters.intersection(kwargs))))
+        if catalog is not None:
+            if refresh:
+                catalog.update()
+            return catalog.query(**kwargs)
         scenes = []
         for pattern in glob_patterns(**kwargs):
             for path in glob.glob(os.path.join(self.base_dir, pattern)):
@@ -1,6 +1,9 @@
 import warnings
 import datetime as dt
 import numpy as np
+import pandas as pd
+import pysolar.constants
+import pysolar.solar as solar
 import pysolar.solartime as stime
 from pysolar.solar import get_sun_earth_distance, get_position
 from pysolar.tzinfo_check import check_aware_dt
@@ -22,6 +25,103 @@ def sun_earth_distance(time):
     return get_sun_earth_distance(jme)
 
 
+def _utc_datetime64(times):
+    """
+    :param times: array-like of aware datetimes, pandas DatetimeIndex or numpy datetime64
+       (naive times are assumed to be UTC).
+    :return: numpy datetime64[ns] array (naive UTC), in the shape of `times`
+    """
+    shape = np.shape(times)
+    if not isinstance(times, pd.DatetimeIndex):
+        times = np.ravel(np.asarray(times, dtype=object if np.ndim(times) else None))
+    index = pd.to_datetime(times, utc=True).tz_localize(None)
+    return np.asarray(index.values).reshape(shape)
+
+
+def julian_days(times):
+    """
+    Vectorized version of pysolar's julian solar day and julian ephemeris day.
+    Leap seconds and delta-t only change per month, so they are computed once per month.
+    :param times: see `_utc_datetime64`
+    :return: (jd, jde) arrays
+    """
+    t64 = _utc_datetime64(times)
+    seconds = (t64 - np.datetime64('1970-01-01T00:00:00')) / np.timedelta64(1, 's')
+    months, inverse = np.unique(t64.astype('datetime64[M]'), return_inverse=True)
+    leap_seconds, delta_t = np.zeros(len(months)), np.zeros(len(months))
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', "I don't know about leap seconds after")
+        warnings.filterwarnings('ignore', 'Leap seconds for year')
+        for i, month in enumerate(months):
+            month = month.astype(dt.date)
+            when = dt.datetime(month.year, month.month, 1, tzinfo=dt.timezone.utc)
+            leap_seconds[i], delta_t[i] = stime.get_leap_seconds(when), stime.get_delta_t(when)
+    leap_seconds = leap_seconds[inverse].reshape(t64.shape)
+    delta_t = delta_t[inverse].reshape(t64.shape)
+    day_offset = stime.gregorian_day_offset + stime.julian_day_offset
+    jde = (seconds + leap_seconds + stime.tt_offset) / pysolar.constants.seconds_per_day + day_offset
+    jd = jde - delta_t / pysolar.constants.seconds_per_day
+    return jd, jde
+
+
+def sun_earth_distances(times):
+    """
+    Vectorized `sun_earth_distance`
+    :param times: see `_utc_datetime64`
+    :return: array of distances, in astronomical units
+    """
+    jde = julian_days(times)[1]
+    jme = stime.get_julian_ephemeris_millennium(stime.get_julian_ephemeris_century(jde))
+    return get_sun_earth_distance(jme)
+
+
+def sun_positions(times, longitude, latitude, elevation=0):
+    """
+    Vectorized version of pysolar's `get_position`. `times`, `longitude`, `latitude`
+    and `elevation` are broadcast against each other, so this can be used for a time series
+    at one location, or for a grid of locations at a single time.
+    :param times: see `_utc_datetime64`
+    :return: (azimuth, elevation) arrays, in degrees
+    """
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    jd, jde = julian_days(times)
+    jce = stime.get_julian_ephemeris_century(jde)
+    jme = stime.get_julian_ephemeris_millennium(jce)
+    # same steps as in `pysolar.solar.get_topocentric_position`, on arrays
+    projected_radial_distance = solar.get_projected_radial_distance(elevation, latitude)
+    projected_axial_distance = solar.get_projected_axial_distance(elevation, latitude)
+    geocentric_latitude = solar.get_geocentric_latitude(jme)
+    geocentric_longitude = solar.get_geocentric_longitude(jme)
+    sun_earth_distance = get_sun_earth_distance(jme)
+    aberration_correction = solar.get_aberration_correction(sun_earth_distance)
+    equatorial_horizontal_parallax = solar.get_equatorial_horizontal_parallax(sun_earth_distance)
+    nutation = solar.get_nutation(jce)
+    apparent_sidereal_time = solar.get_apparent_sidereal_time(jd, jme, nutation)
+    true_ecliptic_obliquity = solar.get_true_ecliptic_obliquity(jme, nutation)
+    apparent_sun_longitude = solar.get_apparent_sun_longitude(geocentric_longitude, nutation, aberration_correction)
+    geocentric_sun_right_ascension = solar.get_geocentric_sun_right_ascension(
+        apparent_sun_longitude, true_ecliptic_obliquity, geocentric_latitude)
+    geocentric_sun_declination = solar.get_geocentric_sun_declination(
+        apparent_sun_longitude, true_ecliptic_obliquity, geocentric_latitude)
+    local_hour_angle = solar.get_local_hour_angle(apparent_sidereal_time, longitude, geocentric_sun_right_ascension)
+    parallax_sun_right_ascension = solar.get_parallax_sun_right_ascension(
+        projected_radial_distance, equatorial_horizontal_parallax, local_hour_angle, geocentric_sun_declination)
+    topocentric_local_hour_angle = solar.get_topocentric_local_hour_angle(
+        local_hour_angle, parallax_sun_right_ascension)
+    topocentric_sun_declination = solar.get_topocentric_sun_declination(
+        geocentric_sun_declination, projected_axial_distance, equatorial_horizontal_parallax,
+        parallax_sun_right_ascension, local_hour_angle)
+    # same steps as in `pysolar.solar.get_position`
+    topocentric_elevation_angle = solar.get_topocentric_elevation_angle(
+        latitude, topocentric_sun_declination, topocentric_local_hour_angle)
+    refraction_correction = solar.get_refraction_correction(
+        pysolar.constants.standard_pressure, pysolar.constants.standard_temperature, topocentric_elevation_angle)
+    altitude = topocentric_elevation_angle + refraction_correction
+    azimuth = solar.get_topocentric_azimuth_angle(
+        topocentric_local_hour_angle, latitude, topocentric_sun_declination)
+    return np.broadcast_arrays(azimuth, altitude)
+
+
 def s2_julian_day(timestamp, delta):
     return (timestamp - _s2_julian_epoch_t)/(3600*24) + delta
 
@@ -40,6 +140,9 @@ class SunLocator:
     Compute sun position, distance and related attributes, relative to a fixed
     position on earth.
     Methods of this class take as input a timezone-aware datetime object.
+    The plural methods (`positions`, `distances_au`, ...) take arrays of times (see
+    `_utc_datetime64`), and compute all values in one vectorized pass. For these methods
+    the longitude and latitude may also be arrays (e.g. a grid of pixel locations).
     """
     def __init__(self, longitude, latitude, elevation=0):
         self.longitude = longitude
@@ -82,3 +185,22 @@ class SunLocator:
     def direct_horizontal_irradiance(self, time, base_flux=solar_constant):
         return self.direct_normal_irradiance(time, base_flux) *\
             np.sin(self.position(time).elevation * np.pi / 180)
+
+    def positions(self, times):
+        """
+        :return: (azimuth, elevation) arrays of the sun position, in degrees
+        """
+        return sun_positions(times, self.longitude, self.latitude, self.elevation)
+
+    def distances_au(self, times):
+        """
+        :return: array of Earth-Sun distances, in astronomical units.
+        """
+        return sun_earth_distances(times)
+
+    def direct_normal_irradiances(self, times, base_flux=solar_constant):
+        return base_flux / self.distances_au(times) ** 2
+
+    def direct_horizontal_irradiances(self, times, base_flux=solar_constant):
+        elevation = self.positions(times)[1]
+        return self.direct_normal_irradiances(times, base_flux) * np.sin(elevation * np.pi / 180)
@@ -0,0 +1,69 @@
+"""
+Caching of parsed metadata files in compact json "sidecar" files next to them
+(`<path>.<key hash>.calval.json`), invalidated when the metadata file changes.
+datetimes and numpy arrays are preserved.
+"""
+import os
+import json
+import uuid
+import hashlib
+import datetime as dt
+import dateutil.parser
+import numpy as np
+
+sidecar_suffix = '.calval.json'
+
+
+class _Encoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, np.ndarray):
+            return {'__ndarray__': o.tolist(), 'dtype': o.dtype.str}
+        if isinstance(o, dt.datetime):
+            return {'__datetime__': o.isoformat()}
+        if isinstance(o, np.generic):
+            return o.item()
+        return super().default(o)
+
+
+def _decode(obj):
+    if '__ndarray__' in obj:
+        return np.array(obj['__ndarray__'], dtype=obj['dtype'])
+    if '__datetime__' in obj:
+        return dateutil.parser.parse(obj['__datetime__'])
+    return obj
+
+
+def sidecar_path(path, key=''):
+    return '{}.{}{}'.format(path, hashlib.sha1(str(key).encode()).hexdigest()[:8], sidecar_suffix)
+
+
+def cached_parse(path, parse, key=''):
+    """
+    :return: `parse(path)` (a json-able value), cached in a sidecar file of `path`, by `key`
+       (which should identify the parsing: its arguments, and a version of the parser output
+       which is bumped when it changes, e.g. `ODL_PARSER_VERSION`).
+       The cache is invalid if the mtime or size of `path` changed. If the sidecar cannot be
+       written (e.g. read-only folder), the value is returned uncached.
+    """
+    stat = os.stat(path)
+    version = [stat.st_mtime_ns, stat.st_size, str(key)]
+    cache_path = sidecar_path(path, key)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f, object_hook=_decode)
+        if cached['version'] == version:
+            return cached['value']
+    except (OSError, ValueError, KeyError):
+        pass
+    value = parse(path)
+    tmp_path = '{}.{}.tmp'.format(cache_path, uuid.uuid4().hex)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'value': value}, f, cls=_Encoder, separators=(',', ':'))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return value
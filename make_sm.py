@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 import numpy as np
 import telluric as tl
@@ -14,6 +15,7 @@ import calval.providers.sentinel  # noqa: F401
 import calval.providers.landsat  # noqa: F401
 from calval.scene_utils import make_sat_measurements
 from calval.sat_measurements import SatMeasurements
+from calval.azure_storage import AzureStorage
 
 
 logger = logging.getLogger()
@@ -166,6 +168,10 @@ def upload_normalized(scene, bands, product):
         svc.create_blob_from_path(
             container, blob_name, local_path,
             progress_callback=t.update_to)
+    # if the container has a manifest, queries are answered from it
+    with open(local_path) as f:
+        metadata = json.load(f)
+    AzureStorage(connection_string, container, service=svc).publish_manifest([metadata], create=False)
 
 
 if (0):
@@ -41,6 +41,9 @@ setup(
         'azure_storage': [
             'azure-storage-blob'
         ],
+        'parquet': [
+            'pyarrow'
+        ],
     },
     dependency_links=dependency_links
 )
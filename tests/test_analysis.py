@@ -1,7 +1,9 @@
 import os
 import datetime as dt
 import glob
+import types
 import numpy as np
+import pandas as pd
 import pytest
 
 import calval.utils.batch_plot  # noqa: F401
@@ -10,9 +12,11 @@ from calval.sun_locator import SunLocator
 from calval.geometry import IncidenceAngle
 from calval.satellites.srf import (
     SRF, Sentinel2Green, Sentinel2Blue, Landsat8Blue, Landsat8Green, Landsat8Red, Landsat8Nir)
+from calval.satellites.multiband_srf import MultiBandSRF, Newsat3HyperSpectralSRF
+import calval.analysis
 from calval.analysis import (
-    integrate, plot, exatmospheric_irradiance, srf_exatmospheric_irradiance,
-    toa_irradiance_to_reflectance)
+    integrate, integrate_many, plot, exatmospheric_irradiance, srf_exatmospheric_irradiance,
+    multiband_exatmospheric_irradiance, solar_spectrum, toa_irradiance_to_reflectance)
 
 
 def test_integrate():
@@ -39,6 +43,28 @@ def test_exatmospheric_irradiance():
         assert irradiance == pytest.approx(ref_value, rel=0.03)
 
 
+def test_solar_spectrum_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(calval.analysis, 'solar_spectrum_cache_dir', str(tmpdir))
+    params = (1.0, 400.0, 1000.0)
+    solar_spectrum.cache_clear()
+    wavelengths, irradiance = solar_spectrum(*params)
+    assert solar_spectrum(*params)[0] is wavelengths
+    assert len(tmpdir.listdir()) == 1
+    # loaded from the disk cache
+    solar_spectrum.cache_clear()
+    cached_wavelengths, cached_irradiance = solar_spectrum(*params)
+    assert cached_wavelengths is not wavelengths
+    assert np.array_equal(cached_wavelengths, wavelengths)
+    assert np.array_equal(cached_irradiance, irradiance)
+    solar_spectrum.cache_clear()
+
+
+def test_multiband_exatmospheric_irradiance():
+    srfs = Newsat3HyperSpectralSRF().srfs[:10] + [Landsat8Blue(), Landsat8Nir()]
+    irradiances = multiband_exatmospheric_irradiance(MultiBandSRF(srfs))
+    assert irradiances == pytest.approx([srf_exatmospheric_irradiance(srf) for srf in srfs])
+
+
 def test_plot():
     pathlist = glob.glob(os.path.join('tests', 'data', 'datastore', 'BTCN', '*'))
     sm = SiteMeasurements.from_pathlist(pathlist)[dt.datetime(2018, 5, 28): dt.datetime(2018, 5, 29)]
@@ -102,3 +128,39 @@ def test_toa_irradiance_to_reflectance():
         reflectance_correct = toa_irradiance_to_reflectance(
             blue_irradiance[i], sunflux, locator, time)
         assert reflectance < reflectance_correct < 1.0
+
+
+def test_integrate_many():
+    index = pd.date_range('2018-05-28', periods=5, freq='30min')
+    wavelengths = np.arange(400, 1000, 10)
+    rng = np.random.RandomState(0)
+    sm = types.SimpleNamespace(**{
+        data: pd.DataFrame(rng.rand(len(index), len(wavelengths)), index=index, columns=wavelengths.astype(str))
+        for data in ['toa', 'toa_errs', 'sr', 'sr_errs']})
+    sm.toa.iloc[1, 3] = np.nan
+    srfs = [SRF(500, 530, [.2, .3, .4, .5]), Sentinel2Blue(), Landsat8Nir()]
+    result = integrate_many(sm, srfs)
+    for i, srf in enumerate(srfs):
+        for data, series in zip(['toa', 'toa_errs', 'sr', 'sr_errs'], integrate(sm, srf)):
+            df = getattr(sm, data)
+            expected = [np.dot(np.nan_to_num(srf(wavelengths)), np.nan_to_num(row.values)) for _, row in df.iterrows()]
+            assert series.values == pytest.approx(expected, rel=1e-5)
+            assert result[data][i].values == pytest.approx(expected, rel=1e-5)
+
+
+class _FlatSRF(SRF):
+    def __call__(self, wavelength, outside_value=0.0):
+        return np.ones_like(wavelength, dtype=float)
+
+
+def test_integrate_many_srf_call():
+    index = pd.date_range('2018-05-28', periods=3, freq='30min')
+    wavelengths = np.arange(400, 1000, 10)
+    sm = types.SimpleNamespace(**{
+        data: pd.DataFrame(np.ones((len(index), len(wavelengths))), index=index, columns=wavelengths.astype(str))
+        for data in ['toa', 'toa_errs', 'sr', 'sr_errs']})
+    # same parameters, but different classes: the overridden `__call__` is used, and not mixed up in the cache
+    params = (500, 530, [.2, .3, .4, .5])
+    result = integrate_many(sm, [SRF(*params), _FlatSRF(*params)])
+    assert result['toa'][0].values == pytest.approx(np.sum(SRF(*params)(wavelengths)))
+    assert result['toa'][1].values == pytest.approx(len(wavelengths))
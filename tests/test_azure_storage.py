@@ -1,8 +1,10 @@
+import threading
+from collections import namedtuple, Counter
 import pytest
 from testing_utils import config
-from calval.azure_storage import AzureStorage
+from calval.azure_storage import AzureStorage, BlockBlobService
 
-pytest.importorskip('azure.storage.blob')
+requires_azure = pytest.mark.skipif(BlockBlobService is None, reason='Missing module: azure.storage.blob')
 
 account_cstring = (
     'DefaultEndpointsProtocol=https;'
@@ -15,12 +17,14 @@ sas_cstring = (
     'sig=dummy4%3D')
 
 
+@requires_azure
 def test_cstring_parse():
     for cstring in [account_cstring, sas_cstring]:
         store = AzureStorage(cstring, 'cicd')
         assert store.endpoint == 'https://dummyaccount.blob.core.windows.net'
 
 
+@requires_azure
 @pytest.mark.skipif('azure_cicd_connection' not in config,
                     reason='Azure connection string not configured')
 def test_query():
@@ -34,3 +38,135 @@ def test_query():
     assert len(scenes) == 0
     scenes = storage.query(satellite='LC08', product='toa', tag='0')
     assert len(scenes) == 2
+
+
+_blob = namedtuple('blob', ['name'])
+_text_blob = namedtuple('text_blob', ['content', 'properties'])
+_blob_properties = namedtuple('blob_properties', ['etag'])
+
+
+class _ConditionFailed(Exception):
+    status_code = 412
+
+
+class _NotModified(Exception):
+    status_code = 304
+
+
+class _NotFound(Exception):
+    status_code = 404
+
+
+class FakeBlobService:
+    """
+    In-memory replacement of `BlockBlobService`, counting `list_blobs` calls per prefix,
+    and blob reads (`reads`, `not_modified`)
+    """
+    def __init__(self, container, blob_names):
+        self.container = container
+        self.blob_names = sorted(blob_names)
+        self.calls = Counter()
+        self.reads = Counter()
+        self.texts = {}
+        self.etag_counter = 0
+        self._lock = threading.Lock()
+
+    def get_blob_to_text(self, container, blob_name, if_none_match=None):
+        self.reads['requests'] += 1
+        if blob_name not in self.texts:
+            raise _NotFound()
+        text, etag = self.texts[blob_name]
+        if if_none_match == etag:
+            self.reads['not_modified'] += 1
+            raise _NotModified()
+        return _text_blob(text, _blob_properties(etag))
+
+    def create_blob_from_text(self, container, blob_name, text, if_match=None, if_none_match=None):
+        current = self.texts.get(blob_name)
+        if (if_none_match == '*' and current is not None) or (
+                if_match is not None and (current is None or current[1] != if_match)):
+            raise _ConditionFailed()
+        self.etag_counter += 1
+        self.texts[blob_name] = (text, 'etag{}'.format(self.etag_counter))
+
+    def list_blobs(self, container, prefix='', delimiter=None):
+        assert container == self.container and delimiter == '/'
+        with self._lock:
+            self.calls[prefix] += 1
+        names = []
+        for name in self.blob_names:
+            if name.startswith(prefix):
+                slash = name.find('/', len(prefix))
+                names.append(name if slash < 0 else name[:slash + 1])
+        return [_blob(name) for name in sorted(set(names))]
+
+
+def test_query_fake_service():
+    scene_ids = ['toa_LC08_174039_201805150810_0', 'toa_LC08_174039_201805310810_0',
+                 'sr_LC08_174039_201805150810_0', 'toa_S2A_T36RXU_201805260816_0',
+                 'toa_S2A_T36RXU_201805260816_1']
+    blob_names = ['calval_test/{}/{}_{}'.format(scene_id.replace('_', '/'), scene_id, fname)
+                  for scene_id in scene_ids for fname in ['metadata.json', 'blue.tif']]
+    service = FakeBlobService('cicd', blob_names)
+    storage = AzureStorage(account_cstring, 'cicd', 'calval_test/', service=service, max_workers=4)
+    scenes = storage.query(satellite='LC08', product=['sr', 'toa'])
+    metadata_names = sorted(scene._metadata_url.rsplit('/', 1)[1] for scene in scenes)
+    assert metadata_names == sorted('{}_metadata.json'.format(scene_id) for scene_id in scene_ids[:3])
+    assert len(storage.query()) == 5
+    assert len(storage.query(satellite='LC08', product='toa', tag='1')) == 0
+    assert len(storage.query(satellite='S2A', product='toa', tag='1')) == 1
+    assert len(storage.query(product='toa', timestamp=['201805150810', '201805260816'])) == 3
+    # repeated queries are served from the cache
+    assert max(service.calls.values()) == 1
+    storage.clear_cache()
+    storage.query()
+    assert max(service.calls.values()) == 2
+    # without cache
+    service.calls.clear()
+    storage = AzureStorage(account_cstring, 'cicd', 'calval_test/', service=service, cache_ttl=None)
+    storage.query()
+    storage.query()
+    assert service.calls['calval_test/'] == 2
+
+
+def test_manifest_fake_service():
+    service = FakeBlobService('cicd', [])
+    storage = AzureStorage(account_cstring, 'cicd', 'calval_test/', service=service, cache_ttl=None)
+    assert storage.query() == []
+    metadata = [
+        {'scene_id': 'toa_LC08_174039_201805150810_0', 'timestamp': '2018-05-15T08:10:30+00:00',
+         'metadata': {'cloud_cover': 0.04}},
+        {'scene_id': 'toa_S2A_T36RXU_201805260816_0', 'timestamp': '2018-05-26T08:16:01+00:00',
+         'metadata': {'cloud_cover': 0.5}},
+    ]
+    # without a manifest, scenes are not published unless requested
+    assert not storage.publish_manifest(metadata[:1], create=False)
+    assert storage.publish_manifest(metadata[:1])
+    storage.publish_manifest(metadata[1:])
+    service.calls.clear()
+    service.reads.clear()
+    scenes = storage.query(product='toa')
+    assert len(scenes) == 2 and sum(service.calls.values()) == 0
+    # an unchanged manifest is checked by a single conditional read
+    storage.query(product='toa')
+    assert service.reads == {'requests': 2, 'not_modified': 1}
+    assert scenes[0].band_urls['blue'] == (
+        storage.public_url_prefix() + 'toa/LC08/174039/201805150810/0/toa_LC08_174039_201805150810_0_blue.tif')
+    assert len(storage.query(max_cloud_cover=0.1)) == 1
+
+    # concurrent update between read and write of the manifest is retried
+    read_manifest = storage._read_manifest
+    updated = []
+
+    def racing_read_manifest(*args):
+        result = read_manifest(*args)
+        if not updated:
+            updated.append(True)
+            name = 'calval_test/manifest.json'
+            service.create_blob_from_text('cicd', name, service.texts[name][0], if_match=service.texts[name][1])
+        return result
+
+    storage._read_manifest = racing_read_manifest
+    storage.publish_manifest([dict(metadata[0], scene_id='sr_LC08_174039_201805150810_0')])
+    assert service.etag_counter == 4  # 2 publishes, the racing update and the retry
+    assert len(storage.query()) == 3
@@ -0,0 +1,35 @@
+import pytest
+import numpy as np
+from calval.band_stats import band_stats, stat_quantile
+
+
+def test_band_stats():
+    rng = np.random.default_rng(0)
+    raw = np.ma.masked_array(rng.integers(1, 10000, size=(1, 101, 99)).astype(np.uint16),
+                             mask=rng.random((1, 101, 99)) < 0.2)
+    stats = ['median', 'average', 'std', 'min', 'max', 'count', 'p5', 'p97.5']
+    for scale in [(2e-5, -0.1), (-1e-4, 1.0)]:
+        scaled = raw * scale[0] + scale[1]
+        values = band_stats(raw, scale, stats)
+        assert list(values) == stats
+        assert values['median'] == pytest.approx(np.ma.median(scaled), rel=1e-12)
+        assert values['average'] == pytest.approx(np.ma.average(scaled), rel=1e-12)
+        assert values['std'] == pytest.approx(np.ma.std(scaled), rel=1e-9)
+        assert values['min'] == pytest.approx(scaled.min(), rel=1e-12)
+        assert values['max'] == pytest.approx(scaled.max(), rel=1e-12)
+        assert values['count'] == scaled.count()
+        assert values['p5'] == pytest.approx(np.percentile(scaled.compressed(), 5), rel=1e-12)
+        assert values['p97.5'] == pytest.approx(np.percentile(scaled.compressed(), 97.5), rel=1e-12)
+    # float32 images, and unmasked images are not modified
+    image = np.ma.masked_array(rng.random((1, 10, 10)).astype(np.float32))
+    original = image.copy()
+    assert band_stats(image)['median'] == pytest.approx(np.median(original), rel=1e-6)
+    assert np.array_equal(image, original)
+    # all masked
+    values = band_stats(np.ma.masked_all((1, 4, 4), dtype=np.uint16), stats=stats)
+    assert values['count'] == 0
+    assert all(np.isnan(value) for stat, value in values.items() if stat != 'count')
+    with pytest.raises(ValueError):
+        stat_quantile('p101')
+    with pytest.raises(ValueError):
+        stat_quantile('mode')
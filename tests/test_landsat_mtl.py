@@ -0,0 +1,68 @@
+import os
+import glob
+import shutil
+import numpy as np
+from testing_utils import config
+from calval.providers.landsat.landsat_mtl import read_mtl, parse_odl, cached_parse_odl, ephemeris_df
+from calval.utils.sidecar import sidecar_suffix
+
+scene_path = os.path.join(config['scenes'], 'LC08_L1TP_174039_20180515_20180604_01_T1')
+mtl_path = glob.glob(os.path.join(scene_path, '*_MTL.txt'))[0]
+ang_path = glob.glob(os.path.join(scene_path, '*_ANG.txt'))[0]
+
+
+def _assert_same(expected, parsed):
+    if isinstance(expected, dict):
+        assert list(expected) == list(parsed)
+        for key in expected:
+            _assert_same(expected[key], parsed[key])
+    elif isinstance(expected, np.ndarray):
+        assert parsed.dtype == expected.dtype and np.array_equal(parsed, expected)
+    elif isinstance(expected, list) and not isinstance(parsed, list):
+        assert isinstance(parsed, np.ndarray)
+        assert parsed.tolist() == expected
+    else:
+        assert parsed == expected
+        assert type(parsed) is type(expected)
+
+
+def test_parse_odl():
+    for path in [mtl_path, ang_path]:
+        _assert_same(read_mtl(path), parse_odl(path))
+    meta = parse_odl(ang_path)
+    assert meta['FILE_HEADER']['BAND_LIST'].dtype.kind == 'i'
+    assert meta['EPHEMERIS']['EPHEMERIS_ECEF_X'].dtype == np.float64
+    assert len(ephemeris_df(meta)) == meta['EPHEMERIS']['NUMBER_OF_POINTS']
+
+
+def test_cached_parse_odl(temp_dir):
+    path = os.path.join(temp_dir, os.path.basename(ang_path))
+    shutil.copy(ang_path, path)
+    parsed = cached_parse_odl(path)
+    assert len(glob.glob(path + '*' + sidecar_suffix)) == 1
+    cached = cached_parse_odl(path)
+    _assert_same(parsed, cached)
+    # modified files are parsed again
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace('END_GROUP = FILE_HEADER', '  EXTRA = 1\nEND_GROUP = FILE_HEADER'))
+    assert cached_parse_odl(path)['FILE_HEADER']['EXTRA'] == 1
+
+
+def test_parse_odl_syntax(temp_dir):
+    path = os.path.join(temp_dir, 'test_MTL.txt')
+    with open(path, 'w') as f:
+        f.write('GROUP = L1_METADATA_FILE\n'
+                '  NAMES = ("a, b", "c")\n'
+                '  VALUES = (1, 2.5,\n    3)\n'
+                'END_GROUP = L1_METADATA_FILE\n'
+                'END\n'
+                'GROUP = IGNORED\nEND_GROUP = IGNORED\n')
+    meta = parse_odl(path)
+    assert list(meta) == ['L1_METADATA_FILE']
+    assert meta['L1_METADATA_FILE']['NAMES'] == ['a, b', 'c']
+    assert meta['L1_METADATA_FILE']['VALUES'].tolist() == [1, 2.5, 3]
+    _assert_same(read_mtl(path), meta)
+    # read_mtl keeps ints and floats of mixed lists apart (like python list literals)
+    assert [type(x) for x in read_mtl(path)['L1_METADATA_FILE']['VALUES']] == [int, float, int]
@@ -0,0 +1,73 @@
+import os
+import threading
+import functools
+import http.server
+import pytest
+from testing_utils import normalize_folders_into
+from calval.storage import FileStorage
+from calval.manifest import Manifest, ManifestStorage, write_manifest
+
+
+@pytest.fixture(scope='module')
+def normalized_dir(module_temp_dir):
+    base_dir = os.path.join(module_temp_dir, 'normalized')
+    normalize_folders_into(base_dir)
+    write_manifest(base_dir)
+    return base_dir
+
+
+def _scene_ids(scenes):
+    return sorted(scene['scene_id'] for scene in scenes)
+
+
+def test_manifest_query(normalized_dir):
+    storage = FileStorage(normalized_dir)
+    storage.build_catalog()
+    manifest_storage = ManifestStorage(normalized_dir)
+    for kwargs in [{}, dict(satellite='LC08', product=['sr', 'toa']), dict(satellite=['dummy1', 'dummy2']),
+                   dict(max_cloud_cover=0.1), dict(start='2018-05-20', end='2018-06-01')]:
+        scenes = manifest_storage.query(**kwargs)
+        assert _scene_ids(scenes) == _scene_ids(storage.query(**kwargs))
+    with pytest.raises(AssertionError) as excinfo:
+        manifest_storage.query(nonexistant='blah')
+    assert 'Unrecognized field' in str(excinfo)
+    # band urls are taken from the manifest
+    scene = manifest_storage.query(satellite='S2A')[0]
+    assert os.path.isfile(scene.band_urls['blue'])
+    assert manifest_storage.stats['reads'] == 1
+
+    # modified manifest is re-read
+    manifest_path = os.path.join(normalized_dir, 'manifest.json')
+    with open(manifest_path) as f:
+        manifest = Manifest.from_json(f.read())
+    manifest.entries = {k: v for k, v in manifest.entries.items() if 'S2A' not in k}
+    with open(manifest_path, 'w') as f:
+        f.write(manifest.to_json())
+    assert len(manifest_storage.query()) == 3
+    assert manifest_storage.stats['reads'] == 2
+    write_manifest(normalized_dir)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def test_manifest_http(normalized_dir):
+    handler = functools.partial(_QuietHandler, directory=normalized_dir)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        manifest_storage = ManifestStorage(url)
+        scenes = manifest_storage.query(satellite='LC08', product='toa')
+        assert len(scenes) == 2
+        assert scenes[0].band_urls['red'].startswith(url)
+        assert scenes[0]['satellite_class'] == 'landsat8'
+        # not modified: served by a 304 response
+        assert len(manifest_storage.query()) == 4
+        assert manifest_storage.stats == {'reads': 1, 'refreshes': 2}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,10 +1,14 @@
 import os
+import threading
+import functools
+import urllib.error
+import http.server
 import datetime as dt
 import pytest
 import numpy as np
 from testing_utils import normalize_folders_into, config
 from calval.normalized_scene import (
-    NormalizedSceneId, band_names, NormalizedScene, FilebasedScene, URLScene)
+    NormalizedSceneId, band_names, NormalizedScene, FilebasedScene, URLScene, load_url_scenes)
 
 scene_id_strs = [
     'toa_S2B_T49TCF_201806260335',
@@ -111,3 +115,90 @@ def test_url_scene():
     raster = scene2.float_band('green')
     assert raster.image.dtype == np.float64
     assert np.ma.average(raster.image) == pytest.approx(0.2574, rel=1e-4)
+
+
+class _FlakyHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    keep-alive handler that fails the first GET of every path, and records client ports
+    """
+    protocol_version = 'HTTP/1.1'
+    failed = set()
+    client_ports = set()
+
+    def do_GET(self):
+        self.client_ports.add(self.client_address[1])
+        if self.path not in self.failed:
+            self.failed.add(self.path)
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_load_url_scenes(module_temp_dir):
+    normpath = os.path.join(module_temp_dir, 'normalized_http')
+    paths = normalize_folders_into(
+        normpath, ['S2A_MSIL1C_20180526T081601_N0206_R121_T36RXU_20180526T120617.SAFE'])
+    scene_id = FilebasedScene(paths[0]).scene_info
+    handler = functools.partial(_FlakyHandler, directory=normpath)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url_prefix = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        scenes = [URLScene(url_prefix + scene_id.metadata_path()) for _ in range(6)]
+        assert scenes[0].band_headers is None
+        assert load_url_scenes(scenes, max_workers=2, backoff=0, prefetch_bands=True) is scenes
+        for scene in scenes:
+            assert 'metadata' in scene.__dict__
+            assert scene.scene_info == scene_id
+            assert set(scene.band_headers) == set(band_names)
+            assert int(scene.band_headers['red']['Content-Length']) > 0
+        # connections are reused: no more than one per worker, plus reconnects after failures
+        assert len(_FlakyHandler.client_ports) <= 2 + len(_FlakyHandler.failed)
+        with pytest.raises(Exception):
+            load_url_scenes([URLScene(url_prefix + 'nonexistent.json')], retries=1, backoff=0)
+        _test_redirects(url_prefix, scene_id)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _RedirectHandler(http.server.BaseHTTPRequestHandler):
+    """
+    keep-alive handler that redirects /loop to itself, and everything else to `target` (another host)
+    """
+    protocol_version = 'HTTP/1.1'
+    target = None
+
+    def do_GET(self):
+        self.send_response(302)
+        self.send_header('Location', '/loop' if self.path == '/loop' else self.target + self.path.lstrip('/'))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def _test_redirects(target, scene_id):
+    handler = type('_Handler', (_RedirectHandler,), {'target': target})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url_prefix = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        scenes = [URLScene(url_prefix + scene_id.metadata_path()) for _ in range(2)]
+        load_url_scenes(scenes, max_workers=2, backoff=0, prefetch_bands=True)
+        for scene in scenes:
+            assert scene.scene_info == scene_id
+            assert int(scene.band_headers['red']['Content-Length']) > 0
+        with pytest.raises(urllib.error.HTTPError, match='Too many redirects'):
+            load_url_scenes([URLScene(url_prefix + 'loop')], retries=0, backoff=0)
+    finally:
+        server.shutdown()
+        server.server_close()
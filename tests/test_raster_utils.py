@@ -1,9 +1,16 @@
 import os
+import time
+import random
 import shutil
 import glob
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import rasterio as rio
+import telluric as tl
+from affine import Affine
 from testing_utils import config
-from calval.raster_utils import TileCache, hires_tile, asfloat
+from calval.sites import get_site_aoi
+from calval.raster_utils import TileCache, BandCache, hires_tile, asfloat, aoi_window, read_aoi
 
 green_url = os.path.join(
     config['scenes'],
@@ -26,7 +33,7 @@ def test_hires_tile():
 
 def test_cache(temp_dir):
     cache = TileCache(os.path.join(temp_dir, 'cache'))
-    assert len(glob.glob(os.path.join(cache.folder, '*.tif'))) == 0
+    assert len(glob.glob(os.path.join(cache.folder, '*', '*.tif'))) == 0
     # copy the raster to the temp dir
     target_path = os.path.join(temp_dir, os.path.basename(green_url))
     shutil.copyfile(green_url, target_path)
@@ -34,9 +41,191 @@ def test_cache(temp_dir):
     tile = hires_tile(target_path, tile_coords, tile_coords[2] + 1,
                       get_tile=cache.get_tile)
     assert tile.shape == (1, 512, 512)
-    assert len(glob.glob(os.path.join(cache.folder, '*.tif'))) == 4
+    assert len(glob.glob(os.path.join(cache.folder, '*', '*.tif'))) == 4
     # remove the target, open again using cache
     os.remove(target_path)
     tile = hires_tile(target_path, tile_coords, tile_coords[2] + 1,
                       get_tile=cache.get_tile)
     assert tile.shape == (1, 512, 512)
+
+
+def test_cache_lazy_scan(temp_dir, monkeypatch):
+    folder = os.path.join(temp_dir, 'cache')
+    cache = TileCache(folder, memory_bytes=0, fetch=_fake_fetch)
+    cache.get_tile('url', (0, 0, 1))
+    # a tile of the older, flat layout
+    path = glob.glob(os.path.join(folder, '*', '*.tif'))[0]
+    os.replace(path, os.path.join(folder, os.path.basename(path)))
+
+    def no_scan(self):
+        raise AssertionError('unexpected scan')
+    monkeypatch.setattr(TileCache, '_entries', no_scan)
+    # neither construction nor access without a size limit scan the cached files
+    cache = TileCache(folder, memory_bytes=0, fetch=_fake_fetch)
+    assert os.path.isfile(os.path.join(folder, os.path.basename(path)))
+    cache.get_tile('url', (1, 0, 1))
+    assert not os.path.exists(os.path.join(folder, os.path.basename(path)))
+    cache.get_tile('url', (0, 0, 1))
+    assert cache.stats['disk_hits'] == 1 and cache.stats['misses'] == 1
+
+
+def test_read_aoi():
+    aoi = get_site_aoi('negev')
+    band_paths = (glob.glob(os.path.join(config['scenes'], 'LC08_L1TP_*', '*_B[2-5].TIF')) +
+                  glob.glob(os.path.join(config['scenes'], '*.SAFE', 'GRANULE', '*', 'IMG_DATA', '*.jp2')))
+    assert band_paths
+    for path in band_paths:
+        expected = tl.GeoRaster2.open(path).crop(aoi)
+        expected = expected.copy_with(image=np.ma.masked_equal(expected.image.data, 0), nodata=0).mask(aoi)
+        with rio.open(path) as dataset:
+            window = aoi_window(dataset, aoi)
+            assert window.width < dataset.width and window.height < dataset.height
+            cropped = read_aoi(dataset, aoi)
+        # exactly the pixels selected by telluric's crop and mask (e.g. landsat pixels in the
+        # last partially covered row/col of the aoi are valid)
+        assert cropped.shape == expected.shape
+        assert cropped.affine.almost_equals(expected.affine)
+        assert np.array_equal(cropped.image.mask, expected.image.mask)
+        assert np.ma.allequal(cropped.image, expected.image)
+
+
+def _fake_fetch(url, coords):
+    image = np.full((1, 64, 64), sum(coords), dtype=np.uint16)
+    return tl.GeoRaster2(image=image, affine=Affine.translation(*coords[:2]) * Affine.scale(1, -1),
+                         crs=tl.constants.WEB_MERCATOR_CRS, nodata=0)
+
+
+def test_cache_eviction(temp_dir):
+    folder = os.path.join(temp_dir, 'bounded_cache')
+    cache = TileCache(folder, memory_bytes=0, fetch=_fake_fetch)
+    cache.get_tile('url', (0, 0, 1))
+    tile_bytes = os.path.getsize(glob.glob(os.path.join(folder, '*', '*.tif'))[0])
+
+    # exact LRU order: evict down to max_bytes
+    cache = TileCache(folder, max_bytes=3 * tile_bytes, memory_bytes=2 * 64 * 64 * 2, fetch=_fake_fetch,
+                      low_water=1.0)
+    for i in range(1, 5):
+        cache.get_tile('url', (i, 0, 1))
+    assert cache.stats['misses'] == 4 and cache.stats['evictions'] == 2
+    assert len(glob.glob(os.path.join(folder, '*', '*.tif'))) == 3
+    # tiles 3, 4 are in memory
+    tile = cache.get_tile('url', (4, 0, 1))
+    assert cache.stats['memory_hits'] == 1
+    assert np.all(tile.image == 5)
+    # tile 2 is read from disk, and becomes most recently used
+    cache.get_tile('url', (2, 0, 1))
+    assert cache.stats['disk_hits'] == 1
+    cache.clear_memory()
+    cache.get_tile('url', (5, 0, 1))
+    assert cache.stats['evictions'] == 3
+    assert cache.get_tile('url', (2, 0, 1)) == _fake_fetch('url', (2, 0, 1))
+    assert cache.stats['disk_hits'] == 2
+    assert cache.get_tile('url', (3, 0, 1)) == _fake_fetch('url', (3, 0, 1))
+    assert cache.stats['misses'] == 6
+
+
+def test_cache_eviction_low_water(temp_dir):
+    folder = os.path.join(temp_dir, 'bounded_cache')
+    cache = TileCache(folder, memory_bytes=0, fetch=_fake_fetch)
+    cache.get_tile('url', (0, 0, 1))
+    tile_bytes = os.path.getsize(glob.glob(os.path.join(folder, '*', '*.tif'))[0])
+    cache.max_bytes = 20 * tile_bytes
+    for i in range(1, 60):
+        cache.get_tile('url', (i, 0, 1))
+    assert cache.stats['misses'] == 60
+    # every scan evicts down to 18 tiles, leaving room for 2 more misses before the next one
+    assert cache.stats['eviction_scans'] == 14
+    assert cache.stats['evictions'] == 42
+    assert len(glob.glob(os.path.join(folder, '*', '*.tif'))) == 18
+    assert cache._disk_size == 18 * tile_bytes
+
+
+def test_concurrent_hires_tile(temp_dir):
+    zoomlevel = tile_coords[2] + 2
+    expected = hires_tile(green_url, tile_coords, zoomlevel)
+    tile = hires_tile(green_url, tile_coords, zoomlevel, max_workers=4)
+    assert tile == expected
+    cache = TileCache(os.path.join(temp_dir, 'concurrent_cache'))
+    tile = hires_tile(green_url, tile_coords, zoomlevel, get_tile=cache.get_tile, max_workers=4)
+    assert tile == expected
+    assert cache.stats['misses'] == 16
+
+
+def test_warped_hires_tile():
+    for zoomlevel in [tile_coords[2], tile_coords[2] + 1]:
+        expected = hires_tile(green_url, tile_coords, zoomlevel)
+        tile = hires_tile(green_url, tile_coords, zoomlevel, engine='warp')
+        assert tile.shape == expected.shape and tile.crs == expected.crs
+        assert tile.affine.almost_equals(expected.affine)
+        assert np.all(tile.image.mask == expected.image.mask)
+        reldiff = np.ma.abs(tile.image.astype(float) - expected.image) / expected.image
+        assert np.percentile(reldiff.compressed(), 99) < 0.01
+    tile_float = hires_tile(green_url, tile_coords, zoomlevel, engine='warp', decode=True)
+    assert tile_float == asfloat(tile)
+
+
+def _counting_fetch(url, coords):
+    # record the fetch (appends are atomic), and make it slow enough for processes to race
+    with open(url, 'a') as f:
+        f.write('{}\n'.format(coords))
+    time.sleep(0.05)
+    return _fake_fetch(url, coords)
+
+
+def _stress_worker(folder, url, coords_list, seed):
+    cache = TileCache(folder, memory_bytes=0, fetch=_counting_fetch)
+    random.Random(seed).shuffle(coords_list)
+    for coords in coords_list:
+        tile = cache.get_tile(url, coords)
+        assert np.all(tile.image == sum(coords))
+    return cache.stats
+
+
+def test_cache_multiprocess(temp_dir):
+    folder = os.path.join(temp_dir, 'shared_cache')
+    url = os.path.join(temp_dir, 'fetch_log.txt')
+    coords_list = [(i, j, 3) for i in range(4) for j in range(4)]
+    num_workers = 12
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(_stress_worker, folder, url, list(coords_list), seed)
+                   for seed in range(num_workers)]
+        stats = [future.result() for future in futures]
+    # every tile was fetched exactly once, by one of the processes
+    with open(url) as f:
+        fetched = f.read().splitlines()
+    assert sorted(fetched) == sorted(str(coords) for coords in coords_list)
+    assert sum(s['misses'] for s in stats) == len(coords_list)
+    assert sum(s['disk_hits'] for s in stats) == len(coords_list) * (num_workers - 1)
+    # only complete tiles are left, in shard folders
+    assert len(glob.glob(os.path.join(folder, '*', '*.tif'))) == len(coords_list)
+    assert glob.glob(os.path.join(folder, '*', '.*')) == []
+
+
+def test_band_cache(temp_dir):
+    source = os.path.join(temp_dir, os.path.basename(green_url))
+    shutil.copy(green_url, source)
+    cache = BandCache(os.path.join(temp_dir, 'bands'))
+    path = cache.get(source)
+    assert cache.get(source) == path
+    assert cache.stats['misses'] == 1 and cache.stats['hits'] == 1
+    with rio.open(source) as src, rio.open(path) as dst:
+        assert dst.driver == 'GTiff'
+        assert dst.profile['tiled'] and dst.block_shapes == [(512, 512)]
+        assert dst.compression == rio.enums.Compression.deflate
+        assert dst.overviews(1) == [2]
+        assert dst.crs == src.crs and dst.transform == src.transform
+        assert np.array_equal(dst.read(), src.read())
+    # a modified source is transcoded again, and its old entry removed
+    os.utime(source, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    new_path = cache.get(source)
+    assert new_path != path
+    assert not os.path.exists(path)
+    assert cache.stats['invalidations'] == 1
+    # quota: the least recently used entry is evicted
+    other_source = os.path.join(temp_dir, 'other.jp2')
+    shutil.copy(green_url, other_source)
+    cache.max_bytes = os.path.getsize(new_path) + 1
+    other_path = cache.get(other_source)
+    assert os.path.exists(other_path) and not os.path.exists(new_path)
+    assert cache.stats['evictions'] == 1 and cache.stats['eviction_scans'] == 1
+    assert cache._disk_size == os.path.getsize(other_path)
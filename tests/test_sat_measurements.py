@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+import pandas as pd
+from calval.sat_measurements import SatMeasurements
+
+
+def _make_sat_measurements():
+    index = pd.DatetimeIndex(pd.date_range('2018-05-01', periods=6, freq='10D', tz='UTC'), name='timestamp')
+    df = pd.DataFrame({
+        'provider': ['landsat8', 'sentinel2'] * 3,
+        'blue_mean': np.arange(6, dtype=float),
+        'blue_std': np.ones(6),
+        'red_mean': np.arange(6, dtype=float) * 2,
+        'red_std': np.zeros(6),
+    }, index=index)
+    return SatMeasurements(df, 'negev', 'toa', label='test')
+
+
+def test_parquet_roundtrip(tmpdir):
+    pytest.importorskip('pyarrow')
+    sat_meas = _make_sat_measurements()
+    path = sat_meas.write(str(tmpdir), format='parquet')
+    assert path.endswith('negev_toa_test.parquet')
+
+    loaded = SatMeasurements.read(path)
+    assert (loaded.site, loaded.product, loaded.label) == ('negev', 'toa', 'test')
+    pd.testing.assert_frame_equal(loaded.df, sat_meas.df, check_freq=False)
+
+    loaded = SatMeasurements.from_parquetfile(path, bands=['red'], start='2018-05-11', end='2018-06-10')
+    expected = sat_meas.df[['provider', 'red_mean', 'red_std']].iloc[1:4]
+    pd.testing.assert_frame_equal(loaded.df, expected, check_freq=False)
@@ -1,11 +1,24 @@
 import os
+import sys
+import json
+import glob
+import shutil
+import tarfile
+import zipfile
+import subprocess
 import pytest
 import numpy as np
+import pandas as pd
+import testing_utils
 from testing_utils import config, normalize_folders_into
-from calval.providers import SceneInfo
-from calval.scene_utils import make_sat_measurements, TilePile
+from calval.providers import SceneInfo, SceneData
+from calval.sat_measurements import SatMeasurements
+from calval.scene_utils import (
+    make_sat_measurements, make_multisite_sat_measurements, update_sat_measurements, TilePile, DiskTilePile)
 from calval.normalized_scene import band_names
 from calval.storage import FileStorage
+from calval.utils.sidecar import sidecar_suffix
+from calval.providers.scene_info import partial_marker
 
 expected_blue_toa = {'landsat8': 0.21, 'sentinel2': 0.23}
 expected_blue_sr = {'landsat8': 0.19}
@@ -53,3 +66,252 @@ def test_tile_pile(norm_scene_storage):
     assert q[2] == 0
     assert pile.self_abs_reldiff_quantile(0) == 0
     assert pile.self_reldiff_quantile(0.5) == 0
+
+
+def test_disk_tile_pile(norm_scene_storage, temp_dir):
+    scenes = norm_scene_storage.query(product='toa')
+    pile = TilePile(scenes, 'green', 'negev', 10)
+    # a small memory budget, to force many chunks and rounds of narrowing
+    disk_pile = DiskTilePile(scenes, 'green', 'negev', 10, memory_bytes=1 << 16, dir=temp_dir)
+    assert len(disk_pile._row_chunks()) > 1
+    assert isinstance(disk_pile.raster.image.data, np.memmap)
+    assert np.array_equal(disk_pile.raster.image.filled(0), pile.raster.image.filled(0))
+    assert disk_pile.raster.band_names == pile.raster.band_names
+    assert np.array_equal(disk_pile.median.image.filled(0), pile.median.image.filled(0))
+    assert np.array_equal(disk_pile.median.image.mask, pile.median.image.mask)
+    q = np.arange(0, 1 + 1e-5, 0.1)
+    assert np.array_equal(disk_pile.self_abs_reldiff_quantile(q), pile.self_abs_reldiff_quantile(q))
+    assert np.array_equal(disk_pile.self_reldiff_quantile(q), pile.self_reldiff_quantile(q))
+    assert disk_pile.self_reldiff_quantile(0.5) == pile.self_reldiff_quantile(0.5)
+    q2 = np.arange(0, 1 + 1e-5, 0.25)
+    disk_quantiles, disk_scene_quantiles = disk_pile.self_reldiff_quantiles(q2, absolute=True)
+    quantiles, scene_quantiles = pile.self_reldiff_quantiles(q2, absolute=True)
+    assert np.array_equal(disk_quantiles, quantiles)
+    pd.testing.assert_frame_equal(disk_scene_quantiles, scene_quantiles)
+    disk_pile.close()
+    assert os.listdir(temp_dir) == []
+
+
+def test_reldiff_quantiles(norm_scene_storage):
+    scenes = norm_scene_storage.query(product='toa')
+    pile = TilePile(scenes, 'green', 'negev', 10)
+    q = np.linspace(0, 1, 11)
+    ref_band = pile.median.image
+    quantiles, scene_quantiles = pile.reldiff_quantiles(ref_band, q)
+    assert np.array_equal(quantiles, pile.quantile_reldiff(ref_band, q))
+    assert list(scene_quantiles.index) == pile.raster.band_names
+    assert list(scene_quantiles.columns) == list(q)
+    for i, scene_id in enumerate(pile.raster.band_names):
+        expected = np.nanquantile(((pile.raster.image[i] - ref_band[0]) / ref_band[0]).filled(np.nan), q)
+        assert np.array_equal(scene_quantiles.loc[scene_id], expected)
+    quantiles, _ = pile.reldiff_quantiles(ref_band, q, absolute=True, dtype=np.float32)
+    assert np.allclose(quantiles, pile.quantile_abs_reldiff(ref_band, q), rtol=1e-5, atol=1e-6)
+    # weighted self-distances: the mid values, which are all 0 distances, do not count
+    n = len(scenes)
+    quantiles, _ = pile.self_reldiff_quantiles(q, absolute=True)
+    diff = (np.ma.abs(pile.raster.image - pile.median.image) / pile.median.image).filled(np.nan)
+    weights = np.where(np.isnan(diff), 0, 2)
+    ranks = np.argsort(np.argsort(pile.raster.image.filled(np.nan), axis=0), axis=0)
+    counts = (~pile.raster.image.mask).sum(axis=0) if np.ma.is_masked(pile.raster.image) else n
+    weights[(counts % 2 == 1) & (ranks == counts // 2)] = 0
+    weights[(counts % 2 == 0) & ((ranks == counts // 2) | (ranks == counts // 2 - 1))] = 1
+    assert np.array_equal(quantiles, np.nanquantile(np.repeat(diff.ravel(), weights.ravel()), q))
+
+
+def test_parallel_make_sat_measurements(temp_dir):
+    foldernames = os.listdir(config['scenes'])
+    infos = [SceneInfo.from_foldername(fname, config=config)
+             for fname in foldernames]
+    sm = make_sat_measurements(infos, 'negev', 'toa')
+    for executor in ['process', 'thread']:
+        sm_parallel = make_sat_measurements(infos, 'negev', 'toa', executor=executor, max_workers=2)
+        pd.testing.assert_frame_equal(sm_parallel.df, sm.df)
+
+    # a scene which is missing both folder and archive should be reported, not abort the run
+    bad_config = dict(config, scenes=temp_dir, archives=temp_dir)
+    bad_info = SceneInfo.from_foldername(infos[0].scene_filename(), config=bad_config)
+    sm_parallel = make_sat_measurements(infos + [bad_info], 'negev', 'toa', max_workers=2)
+    assert len(sm_parallel.df) == len(sm.df) + 1
+    errors = sm_parallel.df['error'].dropna()
+    assert len(errors) == 1
+    assert errors.index[0].date() == bad_info.timestamp.date()
+
+
+def test_archive_extraction(temp_dir):
+    archives = os.path.join(temp_dir, 'archives')
+    scenes = os.path.join(temp_dir, 'scenes')
+    os.mkdir(archives)
+    os.mkdir(scenes)
+    s2_name = 'S2A_MSIL1C_20180526T081601_N0206_R121_T36RXU_20180526T120617'
+    l8_name = 'LC08_L1TP_174039_20180515_20180604_01_T1'
+    with zipfile.ZipFile(os.path.join(archives, s2_name + '.zip'), 'w') as archive:
+        for path in glob.glob(os.path.join(config['scenes'], s2_name + '.SAFE', '**'), recursive=True):
+            archive.write(path, os.path.relpath(path, config['scenes']))
+    with tarfile.open(os.path.join(archives, l8_name + '.tar.gz'), 'w:gz') as archive:
+        for fname in os.listdir(os.path.join(config['scenes'], l8_name)):
+            archive.add(os.path.join(config['scenes'], l8_name, fname), fname)
+    archive_config = dict(config, scenes=scenes, archives=archives)
+    infos = [SceneInfo.from_filename(fname, config=archive_config) for fname in sorted(os.listdir(archives))]
+    sm = make_sat_measurements(infos, 'negev', 'toa', bands=['green', 'nir'])
+    assert 'error' not in sm.df
+    expected = make_sat_measurements(
+        [SceneInfo.from_foldername(info.scene_filename(), config=config) for info in infos],
+        'negev', 'toa', bands=['green', 'nir'])
+    pd.testing.assert_frame_equal(sm.df, expected.df)
+    # only the metadata and the requested bands were extracted
+    l8_files = [f for f in os.listdir(os.path.join(scenes, l8_name))
+                if not f.endswith(sidecar_suffix) and f != partial_marker]
+    assert sorted(f.rsplit('_', 1)[-1] for f in l8_files) == ['ANG.txt', 'B3.TIF', 'B5.TIF', 'MTL.txt']
+    s2_files = [os.path.relpath(path, scenes) for path in glob.glob(os.path.join(scenes, '**'), recursive=True)
+                if os.path.isfile(path) and s2_name in path and not path.endswith(sidecar_suffix)]
+    assert len(s2_files) == 4
+    assert not glob.glob(os.path.join(scenes, s2_name + '.SAFE', 'GRANULE', '*', 'QI_DATA'))
+    # missing bands are extracted into the existing folders
+    sm = make_sat_measurements(infos, 'negev', 'toa', bands=['blue'])
+    assert 'error' not in sm.df
+    assert len(glob.glob(os.path.join(scenes, s2_name + '.SAFE', 'GRANULE', '*', 'IMG_DATA', '*.jp2'))) == 3
+    assert len([f for f in os.listdir(os.path.join(scenes, l8_name)) if f.endswith('.TIF')]) == 3
+
+    # a full extraction completes the partially extracted folders
+    def _files(path):
+        return sorted(os.path.relpath(fpath, path) for fpath in glob.glob(os.path.join(path, '**'), recursive=True)
+                      if os.path.isfile(fpath) and not fpath.endswith(sidecar_suffix))
+    for info in infos:
+        assert os.path.isfile(os.path.join(info.scene_path(), partial_marker))
+        info.extract_archive()
+        assert not os.path.exists(os.path.join(info.scene_path(), partial_marker))
+        assert _files(info.scene_path()) == _files(os.path.join(config['scenes'], info.scene_filename()))
+        with pytest.warns(UserWarning, match='already exists'):
+            info.extract_archive()
+
+
+def test_band_cache(temp_dir):
+    foldernames = os.listdir(config['scenes'])
+    cache_config = dict(config, band_cache=os.path.join(temp_dir, 'bands'))
+    infos = [SceneInfo.from_foldername(fname, config=cache_config) for fname in foldernames]
+    sm = make_sat_measurements(infos, 'negev', 'toa')
+    # only the sentinel bands are transcoded
+    assert len(os.listdir(os.path.join(temp_dir, 'bands'))) == len(band_names)
+    infos = [SceneInfo.from_foldername(fname, config=config) for fname in foldernames]
+    pd.testing.assert_frame_equal(sm.df, make_sat_measurements(infos, 'negev', 'toa').df)
+
+
+# values of the baseline implementation (telluric crop & mask, per-pixel scaling) for negev toa
+_baseline_landsat_values = {
+    '2018-05-15 08:10:30.922238+00:00': [
+        0.21221, 0.21255847457627122, 0.01057487369216701, 0.27315000000000006, 0.27073389830508476,
+        0.017117773201543732, 0.36635, 0.3626993220338984, 0.02576264013370924, 0.4558100000000001,
+        0.4499759322033899, 0.027837992397821486],
+    '2018-05-31 08:10:17.858412+00:00': [
+        0.21392000000000003, 0.21584418604651168, 0.015074736538388357, 0.27232, 0.2688413953488373,
+        0.021914157992805064, 0.36766, 0.357897519379845, 0.033987174964441785, 0.4623600000000001,
+        0.4484841860465117, 0.042738990688979475],
+}
+
+
+def test_landsat_baseline_values():
+    infos = [SceneInfo.from_foldername(fname, config=config) for fname in os.listdir(config['scenes'])]
+    sm = make_sat_measurements(infos, 'negev', 'toa', provider='landsat8')
+    assert len(sm.df) == len(_baseline_landsat_values)
+    columns = ['{}_{}'.format(band, stat) for band in band_names for stat in ['median', 'average', 'std']]
+    for timestamp, values in _baseline_landsat_values.items():
+        assert np.allclose(sm.df.loc[pd.Timestamp(timestamp), columns].astype(float), values, rtol=1e-12, atol=0)
+
+
+def test_multisite_sat_measurements(monkeypatch):
+    monkeypatch.setattr('calval.config.shapes_dir', testing_utils.original_shapes_dir)
+    foldernames = os.listdir(config['scenes'])
+    infos = [SceneInfo.from_foldername(fname, config=config)
+             for fname in foldernames]
+    sms = make_multisite_sat_measurements(infos, ['baotou', 'negev'], 'toa')
+    assert list(sms.keys()) == ['baotou', 'negev']
+    assert len(sms['baotou'].df) == 0
+    assert sms['negev'].site == 'negev'
+    pd.testing.assert_frame_equal(sms['negev'].df, make_sat_measurements(infos, 'negev', 'toa').df)
+
+
+def test_update_sat_measurements(temp_dir, monkeypatch):
+    infos = sorted([SceneInfo.from_foldername(fname, config=config)
+                    for fname in os.listdir(config['scenes'])], key=lambda info: info.timestamp)
+    sm = make_sat_measurements(infos, 'negev', 'toa')
+    old = make_sat_measurements(infos[:-1], 'negev', 'toa')
+    old.write(temp_dir)
+    extracted = []
+    from_sceneinfo = SceneData.from_sceneinfo
+
+    def counting_from_sceneinfo(sceneinfo, *args, **kwargs):
+        extracted.append(sceneinfo)
+        return from_sceneinfo(sceneinfo, *args, **kwargs)
+    monkeypatch.setattr(SceneData, 'from_sceneinfo', counting_from_sceneinfo)
+
+    updated = update_sat_measurements(os.path.join(temp_dir, old.fname), infos)
+    assert extracted == infos[-1:]
+    assert isinstance(updated, SatMeasurements)
+    assert (updated.site, updated.product) == ('negev', 'toa')
+    assert updated.df.index.is_monotonic_increasing
+    assert list(updated.df['provider']) == list(sm.df['provider'])
+    assert list(updated.df['scene_id']) == list(sm.df['scene_id'])
+    assert np.allclose(updated.df[sm.df.columns[2:]], sm.df[sm.df.columns[2:]])
+    # nothing new
+    del extracted[:]
+    assert len(update_sat_measurements(updated, infos).df) == len(sm.df)
+    assert extracted == []
+
+
+def test_update_sat_measurements_tiles(temp_dir, monkeypatch):
+    # a copy of the sentinel scene as another tile of negev, from the same datatake
+    s2_name = 'S2A_MSIL1C_20180526T081601_N0206_R121_T36RXU_20180526T120617.SAFE'
+    scenes = os.path.join(temp_dir, 'scenes')
+    shutil.copytree(os.path.join(config['scenes'], s2_name), os.path.join(scenes, s2_name))
+    other_name = s2_name.replace('T36RXU', 'T36RYU')
+    shutil.copytree(os.path.join(scenes, s2_name), os.path.join(scenes, other_name))
+    for path in glob.glob(os.path.join(scenes, other_name, 'GRANULE', '*', 'IMG_DATA', '*.jp2')):
+        os.rename(path, os.path.join(os.path.dirname(path), os.path.basename(path).replace('T36RXU', 'T36RYU')))
+    tiles_config = dict(config, scenes=scenes)
+    infos = [SceneInfo.from_foldername(name, config=tiles_config) for name in [s2_name, other_name]]
+    assert infos[0].timestamp == infos[1].timestamp
+    extracted = []
+    from_sceneinfo = SceneData.from_sceneinfo
+
+    def counting_from_sceneinfo(sceneinfo, *args, **kwargs):
+        extracted.append(sceneinfo)
+        return from_sceneinfo(sceneinfo, *args, **kwargs)
+    monkeypatch.setattr(SceneData, 'from_sceneinfo', counting_from_sceneinfo)
+
+    old = make_sat_measurements(infos[:1], 'negev', 'toa')
+    del extracted[:]
+    updated = update_sat_measurements(old, infos)
+    assert extracted == infos[1:]
+    assert list(updated.df['scene_id']) == [info.scene_id for info in infos]
+    # rows without scene_id (older files) do not tell the tile: the scenes of that date are extracted again
+    del extracted[:]
+    legacy = SatMeasurements(old.df.drop('scene_id', axis=1), 'negev', 'toa')
+    updated = update_sat_measurements(legacy, infos)
+    assert extracted == infos
+    assert sorted(updated.df['scene_id']) == sorted(info.scene_id for info in infos)
+    del extracted[:]
+    assert len(update_sat_measurements(legacy, infos[:1]).df) == 1
+    assert extracted == []
+
+
+# generous budget, the point is to catch heavy imports sneaking back into the import chain
+import_time_budget = 5.0
+_import_time_script = """
+import sys, time, json
+start = time.perf_counter()
+import calval.scene_utils
+elapsed = time.perf_counter() - start
+modules = sorted(sys.modules)
+# provider modules are imported on first use of the factory
+sceneinfo = calval.scene_utils.SceneInfo.from_filename('LC08_L1TP_174039_20180515_20180604_01_T1.tar.gz')
+print(json.dumps({'elapsed': elapsed, 'modules': modules, 'provider': sceneinfo.provider}))
+"""
+
+
+def test_import_time():
+    output = subprocess.check_output([sys.executable, '-c', _import_time_script])
+    result = json.loads(output.decode().splitlines()[-1])
+    for module in ['matplotlib.pyplot', 'pyspectral', 'calval.providers.sentinel', 'calval.providers.landsat']:
+        assert module not in result['modules']
+    assert result['elapsed'] < import_time_budget
+    assert result['provider'] == 'landsat8'
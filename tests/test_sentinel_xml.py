@@ -0,0 +1,82 @@
+import os
+import glob
+import shutil
+import numpy as np
+from testing_utils import config
+from calval.providers import SceneInfo, SceneData
+from calval.providers.sentinel.sentinel_xml import (
+    parse_tile_metadata, parse_xml_metadata, parse_selected, cached_parse_selected)
+from calval.utils.sidecar import sidecar_suffix
+
+scene_path = os.path.join(config['scenes'], 'S2A_MSIL1C_20180526T081601_N0206_R121_T36RXU_20180526T120617.SAFE')
+tile_mtd = glob.glob(os.path.join(scene_path, 'GRANULE', '*', 'MTD_TL.xml'))[0]
+product_mtd = os.path.join(scene_path, 'MTD_MSIL1C.xml')
+
+
+def test_parse_selected():
+    full = parse_tile_metadata(tile_mtd)
+    selected = parse_selected(tile_mtd, [
+        'General_Info/SENSING_TIME', 'Geometric_Info/Tile_Angles/Mean_Sun_Angle',
+        'Geometric_Info/Tile_Angles/Sun_Angles_Grid', 'Geometric_Info/Tile_Angles/Viewing_Incidence_Angles_Grids'])
+    assert list(selected) == ['General_Info', 'Geometric_Info']
+    assert selected['General_Info'] == {'SENSING_TIME': full['General_Info']['SENSING_TIME']}
+    full_angles = full['Geometric_Info']['Tile_Angles']
+    angles = selected['Geometric_Info']['Tile_Angles']
+    assert angles['Mean_Sun_Angle'] == full_angles['Mean_Sun_Angle']
+    assert 'Mean_Viewing_Incidence_Angle_List' not in angles
+    # grids are numpy arrays
+    grid_names = [name for name in full_angles if name.startswith('Viewing_Incidence_Angles_Grids')]
+    assert len(grid_names) > 1
+    assert set(angles) == set(grid_names) | {'Mean_Sun_Angle', 'Sun_Angles_Grid'}
+    for name in grid_names + ['Sun_Angles_Grid']:
+        for angle in ['Zenith', 'Azimuth']:
+            grid = angles[name][angle]
+            assert isinstance(grid['Values_List'], np.ndarray)
+            assert np.array_equal(grid['Values_List'], np.array(full_angles[name][angle]['Values_List']),
+                                  equal_nan=True)
+            assert grid['COL_STEP'] == full_angles[name][angle]['COL_STEP']
+    # nested blocks of the product metadata
+    full = parse_xml_metadata(product_mtd)
+    selected = parse_selected(product_mtd, ['Geometric_Info/Product_Footprint'])
+    assert selected['Geometric_Info'] == {'Product_Footprint': full['Geometric_Info']['Product_Footprint']}
+
+
+def test_scene_data_metadata():
+    data = SceneData.from_sceneinfo(SceneInfo.from_foldername(os.path.basename(scene_path), config=config))
+    # the full metadata is parsed only on first use
+    assert 'metadata' not in data.__dict__ and 'product_meta' not in data.__dict__
+    # (compared by repr, as the angle grids contain NaNs)
+    assert repr(data.metadata) == repr(parse_tile_metadata(tile_mtd))
+    assert 'Quality_Indicators_Info' in data.metadata
+    assert data.product_meta == parse_xml_metadata(product_mtd)
+
+
+def test_cached_parse_selected(temp_dir, monkeypatch):
+    path = os.path.join(temp_dir, 'MTD_TL.xml')
+    shutil.copy(tile_mtd, path)
+    paths = ['General_Info/SENSING_TIME', 'Geometric_Info/Tile_Angles/Sun_Angles_Grid']
+    parsed = cached_parse_selected(path, paths)
+    sidecars = glob.glob(path + '*' + sidecar_suffix)
+    assert len(sidecars) == 1
+    cached = cached_parse_selected(path, paths)
+    assert cached['General_Info']['SENSING_TIME'] == parsed['General_Info']['SENSING_TIME']
+    grid = cached['Geometric_Info']['Tile_Angles']['Sun_Angles_Grid']['Zenith']['Values_List']
+    assert isinstance(grid, np.ndarray)
+    assert np.array_equal(grid, parsed['Geometric_Info']['Tile_Angles']['Sun_Angles_Grid']['Zenith']['Values_List'])
+    # the sidecar is read, rather than the file
+    with open(sidecars[0]) as f:
+        sidecar = f.read()
+    with open(sidecars[0], 'w') as f:
+        f.write(sidecar.replace('"SENSING_TIME":', '"CACHED_TIME":'))
+    assert 'CACHED_TIME' in cached_parse_selected(path, paths)['General_Info']
+    # and invalidated when the file changes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert 'SENSING_TIME' in cached_parse_selected(path, paths)['General_Info']
+    # other paths use another sidecar
+    cached_parse_selected(path, paths[:1])
+    assert len(glob.glob(path + '*' + sidecar_suffix)) == 2
+    # and so does another version of the parser
+    monkeypatch.setattr('calval.providers.sentinel.sentinel_xml.XML_PARSER_VERSION', 'test')
+    cached_parse_selected(path, paths)
+    assert len(glob.glob(path + '*' + sidecar_suffix)) == 3
@@ -0,0 +1,35 @@
+import os
+import pytest
+import pandas as pd
+from testing_utils import config
+from calval.providers import SceneInfo, SceneData
+from calval.scene_utils import make_sat_measurements
+from calval.sites import get_site_aoi
+from calval.stats_cache import StatsCache
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError('raster values should be read from the cache')
+
+
+def test_stats_cache(temp_dir, monkeypatch):
+    path = os.path.join(temp_dir, 'cache', 'stats.sqlite')
+    cache = StatsCache(path)
+    infos = [SceneInfo.from_foldername(fname, config=config)
+             for fname in os.listdir(config['scenes'])]
+    sm = make_sat_measurements(infos, 'negev', 'toa', stats_cache=cache)
+    assert len(sm.df) > 0
+    info = infos[0]
+    aoi = get_site_aoi('negev')
+    assert cache.get(info.scene_id, 'negev', 'dummy', aoi, ['blue']) is None
+
+    with monkeypatch.context() as m:
+        m.setattr(SceneData, 'from_sceneinfo', _fail)
+        sm_cached = make_sat_measurements(infos, 'negev', 'toa', stats_cache=StatsCache(path))
+        pd.testing.assert_frame_equal(sm_cached.df, sm.df)
+        # other version of the statistics code does not use the old entries
+        with pytest.raises(AssertionError):
+            make_sat_measurements(infos, 'negev', 'toa', stats_cache=StatsCache(path, version='other'))
+
+    cache.clear()
+    assert cache.get(info.scene_id, 'negev', 'toa', aoi, ['blue']) is None
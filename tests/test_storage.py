@@ -1,5 +1,8 @@
+import os
 import pytest
-from testing_utils import normalize_folders_into
+import dateutil.parser
+from testing_utils import config, normalize_folders_into
+from calval.normalized_scene import FilebasedScene
 from calval.storage import FileStorage
 
 
@@ -21,3 +24,62 @@ def test_filestorage(temp_dir):
     with pytest.raises(AssertionError) as excinfo:
         scenes = storage.query(nonexistant='blah')
     assert 'Unrecognized field' in str(excinfo)
+
+
+def test_catalog(temp_dir):
+    base_dir = os.path.join(temp_dir, 'catalog')
+    paths = normalize_folders_into(base_dir)
+    storage = FileStorage(base_dir)
+    queries = [{}, dict(satellite='LC08', product=['sr', 'toa']), dict(satellite=['dummy1', 'dummy2'])]
+    expected = [sorted(s['scene_id'] for s in storage.query(**kwargs)) for kwargs in queries]
+    assert storage.catalog is None
+    # range filters require an explicit catalog
+    with pytest.raises(ValueError):
+        storage.query(max_cloud_cover=0.1)
+    assert storage.catalog is None
+    catalog = storage.build_catalog()
+    assert storage.catalog is not None
+    assert catalog.update() == 0  # nothing changed
+
+    # same results as without the catalog
+    for kwargs, expected_ids in zip(queries, expected):
+        assert sorted(s['scene_id'] for s in storage.query(**kwargs)) == expected_ids
+    with pytest.raises(AssertionError) as excinfo:
+        storage.query(nonexistant='blah')
+    assert 'Unrecognized field' in str(excinfo)
+
+    # range queries
+    timestamps = sorted(dateutil.parser.parse(s['timestamp']) for s in storage.query())
+    scenes = storage.query(start=timestamps[1], end=timestamps[-1])
+    assert len(scenes) == len([t for t in timestamps if timestamps[1] <= t < timestamps[-1]])
+    assert all(timestamps[1] <= dateutil.parser.parse(s['timestamp']) < timestamps[-1] for s in scenes)
+    scenes = storage.query(max_cloud_cover=0.1)
+    assert scenes and all(s['metadata']['cloud_cover'] <= 0.1 for s in scenes)
+    negev_bbox = (34.8, 30.0, 35.2, 30.4)
+    assert len(storage.query(bbox=negev_bbox)) == 4
+    assert len(storage.query(bbox=(0, 0, 1, 1))) == 0
+
+    # incremental updates
+    os.utime(paths[0], ns=(0, 0))
+    assert catalog.update() == 1
+    os.remove(paths[0])
+    # queries do not rescan the folder, unless requested
+    assert len(storage.query()) == 4
+    assert len(storage.query(refresh=True)) == 3
+    os.utime(paths[1], ns=(0, 0))
+    assert storage.update_catalog() == 1
+
+
+def test_catalog_save_normalized(temp_dir):
+    base_dir = os.path.join(temp_dir, 'catalog')
+    foldernames = sorted(name for name in os.listdir(config['scenes']) if name.startswith('LC08_L1TP'))
+    normalize_folders_into(base_dir, foldernames[:1])
+    storage = FileStorage(base_dir)
+    storage.build_catalog()
+    assert len(storage.query()) == 1
+    # newly normalized scenes are added to the catalog
+    path, = normalize_folders_into(base_dir, foldernames[1:2])
+    scenes = storage.query()
+    assert len(scenes) == 2
+    assert FilebasedScene(path)['scene_id'] in [scene['scene_id'] for scene in scenes]
+    assert storage.update_catalog() == 0
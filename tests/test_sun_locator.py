@@ -1,6 +1,7 @@
 import datetime as dt
 import dateutil.parser
 import numpy as np
+import pandas as pd
 from pytest import approx
 from calval.sun_locator import SunLocator
 
@@ -56,3 +57,25 @@ def test_irradiance():
     fartime2 = dt.datetime(2019, 7, 4, 12, 30, tzinfo=tz)
     assert sunpos.direct_normal_irradiance(neartime) == approx(sunpos.direct_normal_irradiance(neartime2), rel=1e-3)
     assert sunpos.direct_normal_irradiance(fartime) == approx(sunpos.direct_normal_irradiance(fartime2), rel=1e-3)
+
+
+def test_vectorized():
+    times = [dateutil.parser.parse(t_str) for t_str, _, _ in position_ref]
+    times += [dt.datetime(2018, 1, 1, tzinfo=UTC) + dt.timedelta(days=day, hours=day % 24) for day in range(0, 730, 7)]
+    index = pd.to_datetime(times, utc=True)
+    for arg in [times, index, index.tz_localize(None).values]:
+        azimuth, elevation = sunpos.positions(arg)
+        ref = np.array([[pos.azimuth, pos.elevation] for pos in map(sunpos.position, times)])
+        assert np.allclose(azimuth, ref[:, 0], rtol=1e-6)
+        assert np.allclose(elevation, ref[:, 1], rtol=1e-6)
+        assert np.allclose(sunpos.distances_au(arg), [sunpos.distance_au(t) for t in times], rtol=1e-9)
+        assert np.allclose(sunpos.direct_horizontal_irradiances(arg),
+                           [sunpos.direct_horizontal_irradiance(t) for t in times], rtol=1e-6)
+
+    # grid of locations at a single time
+    lon, lat = np.meshgrid(np.linspace(30, 40, 4), np.linspace(25, 35, 3))
+    azimuth, elevation = SunLocator(lon, lat).positions(times[1])
+    assert azimuth.shape == elevation.shape == (3, 4)
+    for i, j in np.ndindex(lon.shape):
+        pos = SunLocator(lon[i, j], lat[i, j]).position(times[1])
+        assert [azimuth[i, j], elevation[i, j]] == approx([pos.azimuth, pos.elevation], rel=1e-6)
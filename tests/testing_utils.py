@@ -3,6 +3,8 @@ Configuration of testing environment,
 and utils to be used in test functions.
 """
 import os
+import shutil
+import tempfile
 import warnings
 import calval.config
 from calval.providers import SceneInfo, SceneData
@@ -15,7 +17,10 @@ testdir = os.path.abspath(os.path.dirname(__file__))
 original_shapes_dir = calval.config.shapes_dir
 calval.config.shapes_dir = os.path.join(testdir, 'data', 'sites')
 config = dict(SceneInfo.config)
-config.update(scenes=os.path.join(testdir, 'data', 'scenes'))
+# the test scenes are copied, as reading them writes metadata sidecar files next to them
+_scenes_tempdir = tempfile.TemporaryDirectory()
+config.update(scenes=os.path.join(_scenes_tempdir.name, 'scenes'))
+shutil.copytree(os.path.join(testdir, 'data', 'scenes'), config['scenes'])
 
 # Following extra settings do not appear in normal config: maybe add there:
 # if azure is configured, setup url prefix